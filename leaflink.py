@@ -1,7 +1,10 @@
+import html
 import streamlit as st
 import pandas as pd
 import streamlit.components.v1 as components
-from concurrent.futures import ThreadPoolExecutor
+from leaflink_data import AssignmentRules, CUBE_DIMS, DataStore, SheetSync, RULES_PATH, SHEET_ID, display_col, display_row
+from leaflink_perf import span, stats as perf_stats
+from leaflink_writes import GSpreadService, WriteQueue, changed_cells, match_choices, norm_key, row_identity
 
 # --- 1. SETTINGS & PAGE CONFIG ---
 st.set_page_config(page_title="GNC | LeafLink", layout="wide", initial_sidebar_state="expanded")
@@ -111,43 +114,112 @@ if st.session_state.close_sidebar:
     st.session_state.close_sidebar = False
 
 # --- 4. HIGH-PERFORMANCE DATA LOADER ---
-@st.cache_data(ttl=600)
-def load_gnc_data():
+# Edits are journaled locally and pushed to the sheet in batches by a background flusher
+@st.cache_resource
+def get_write_queue():
+    service = None
     try:
-        sheet_id = "1FNuWtLD6okE7tOxD3dRcUXVWL9bwwSye1nhGSVDiiTs"
-        inv_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet=Inventory_Drive_Around"
-        notes_url = f"https://docs.google.com/spreadsheets/d/{sheet_id}/gviz/tq?tqx=out:csv&sheet=S1_SalesNotes"
-
-        def fetch_csv(url):
-            try: return pd.read_csv(url)
-            except: return pd.DataFrame()
-
-        with ThreadPoolExecutor() as executor:
-            future_inv = executor.submit(fetch_csv, inv_url)
-            future_notes = executor.submit(fetch_csv, notes_url)
-            df = future_inv.result()
-            notes_df = future_notes.result()
-
-        if not df.empty:
-            df.columns = df.columns.str.strip().str.upper()
-            required_cols = ['LOC_SALESNOTE', 'CALIPER', 'SPEC', 'LOC_COMMENTS', 'MATCH_PCT', 'PIC_NOTE', 'PRIME_QTY', 'PHOTO', 'STATUS', 'ITEMCODE', 'SALES_ASSIGNEDTO', 'SEASON', 'COMMONNAME', 'CONTSIZE', 'BLOCKALPHA', 'LOCATIONCODE', 'LOTCODE', 'PRIORITY', 'CURRENT_SALESNOTE', 'PTRAVAILABLE', 'S_LTS']
-            missing = [c for c in required_cols if c not in df.columns]
-            if missing: df[pd.Index(missing)] = ""
-            df = df.fillna("").astype(str)
-
-        sales_notes_map = {}
-        if not notes_df.empty:
-            notes_df.columns = notes_df.columns.str.strip().str.upper()
-            if 'ITEMCODE' in notes_df.columns:
-                note_cols = [c for c in notes_df.columns if 'NOTE' in c]
-                note_col = note_cols[0] if note_cols else (notes_df.columns[1] if len(notes_df.columns)>1 else None)
-                if note_col: sales_notes_map = notes_df.groupby('ITEMCODE')[note_col].apply(lambda x: list(x.dropna().astype(str))).to_dict()
-
-        return df, sales_notes_map
-    except Exception as e:
-        return pd.DataFrame(), {}
+        import gspread
+        service = GSpreadService(gspread.service_account_from_dict(dict(st.secrets["connections"]["gsheets"])).open_by_key(SHEET_ID))
+    except Exception: pass
+    return WriteQueue(service=service).start()
+
+# One shared store per server process: a background thread merges sheet changes and
+# publishes each new version (frame + MYTASKS/DRIVEAROUND indexes) for every session to read.
+# MYTASKS assignment comes from leaflink_rules.json; edits to it are picked up on the next tick.
+@st.cache_resource
+def get_store():
+    return DataStore(SheetSync(ttl=600), on_sync=get_write_queue().overlay, snapshot_dir=".leaflink_cache", rules=AssignmentRules(path=RULES_PATH)).start()
+
+def fmt_age(sec):
+    if sec is None: return "never"
+    if sec < 90: return "just now"
+    return f"{int(sec // 60)} min ago" if sec < 5400 else f"{sec / 3600:.1f} h ago"
+
+def load_gnc_data():
+    return get_store().get()
+
+# --- 4b. RENDER HELPERS ---
+PAGE_SIZE = 20  # cards per page in MYTASKS list_items and DRIVEAROUND data
+
+# Input widgets are counted as they are created; the page span logs the count for its rerun
+widget_count = [0]
+
+def counted(make):
+    def widget(*args, **kwargs):
+        widget_count[0] += 1
+        return make(*args, **kwargs)
+    return widget
+
+button, selectbox, text_input = counted(st.button), counted(st.selectbox), counted(st.text_input)
+
+class page_span(span):
+    def __enter__(self):
+        widget_count[0] = 0
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        self.set(widgets=widget_count[0])
+        return super().__exit__(*exc)
+
+def page_slice(frame, key):
+    pages = max(1, -(-len(frame) // PAGE_SIZE))
+    page = min(st.session_state.get(key, 0), pages - 1)
+    if pages > 1:
+        p1, p2, p3 = st.columns([1, 2, 1])
+        with p1:
+            if button("◀", key=f"{key}_prev", disabled=page == 0): st.session_state[key] = page - 1; st.rerun()
+        with p2: st.markdown(f"<div style='text-align:center; color:#888; padding-top:18px;'>PAGE {page + 1} / {pages} • {len(frame)} ITEMS</div>", unsafe_allow_html=True)
+        with p3:
+            if button("▶", key=f"{key}_next", disabled=page == pages - 1): st.session_state[key] = page + 1; st.rerun()
+    start = page * PAGE_SIZE
+    return frame.iloc[start:start + PAGE_SIZE], start
+
+def html_col(frame, col):
+    return display_col(frame[col]).str.replace("&", "&amp;").str.replace("<", "&lt;").str.replace(">", "&gt;")
+
+def row_numbers(frame, start):
+    return pd.Series(range(start + 1, start + len(frame) + 1), index=frame.index).astype(str)
+
+def item_labels(frame, start, cols):
+    label = row_numbers(frame, start) + ". " + display_col(frame[cols[0]])
+    for c in cols[1:]: label = label + " | " + display_col(frame[c])
+    return dict(zip(frame.index, label.tolist()))
+
+def cards_html(frame, start, sub, tags):
+    # Whole page of list cards built column-wise and joined into one markdown block
+    if frame.empty: return ""
+    num = row_numbers(frame, start)
+    sub_line = html_col(frame, sub[0])
+    for c in sub[1:]: sub_line = sub_line + " | " + html_col(frame, c)
+    tag_html = pd.Series("", index=frame.index)
+    for i, (label, c) in enumerate(tags): tag_html = tag_html + (" &nbsp;&bull;&nbsp; " if i else "") + f"{label}: " + html_col(frame, c)
+    cards = ('<div class="list-card"><div class="list-card-title">' + num + '. ' + html_col(frame, 'COMMONNAME') +
+             '</div><div class="list-card-sub">' + sub_line + '</div><div class="list-card-tags">' + tag_html + '</div></div>')
+    return "".join(cards.tolist())
+
+def hud_totals(title, subtitle, totals):
+    # headline numbers from a one-row cube rollup, in the MYTASKS HUD card style
+    t = totals.iloc[0] if not totals.empty else pd.Series(0, index=['ROWS', 'PRIME_QTY', 'PTRAVAILABLE', 'PCT_COMPLETE', 'AVG_PRIORITY'])
+    stats = [("ITEMS", f"{int(t['ROWS']):,}"), ("PRIME QTY", f"{int(t['PRIME_QTY']):,}"), ("PTR", f"{int(t['PTRAVAILABLE']):,}"),
+             ("COMPLETE", "—" if pd.isna(t['PCT_COMPLETE']) else f"{t['PCT_COMPLETE']:.0f}%"), ("AVG PRIORITY", "—" if pd.isna(t['AVG_PRIORITY']) else f"{t['AVG_PRIORITY']:.1f}")]
+    cells = "".join(f'<div class="hud-stat"><div class="hud-label">{k}</div><div class="hud-value">{v}</div></div>' for k, v in stats)
+    return f'<div class="hud-card"><div class="hud-header"><div class="hud-title">{html.escape(str(title))}</div><div class="hud-subtitle">{html.escape(str(subtitle))}</div></div>{cells}</div>'
+
+def cube_table(frame):
+    # cube rollup -> display table; blank dimension values read as "—"
+    out = frame.reset_index()
+    dims = [c for c in out.columns if c in CUBE_DIMS]
+    out[dims] = out[dims].replace("", "—")
+    for c in ['ROWS', 'COMPLETE', 'PRIME_QTY', 'PTRAVAILABLE']: out[c] = out[c].astype('int64')
+    return out.rename(columns={'ROWS': 'ITEMS', 'PCT_COMPLETE': '% COMPLETE', 'AVG_PRIORITY': 'AVG PRIORITY'})
+
+def season_filter(cube, key):
+    season = selectbox("SEASON", ["ALL"] + cube.values('SEASON'), key=key)
+    return {} if season == "ALL" else {'SEASON': season}
 
 # --- 5. STATE MANAGEMENT ---
+VARIETY_PAGE = 50  # variety buttons rendered per "SHOW MORE" page
 if 'page' not in st.session_state: st.session_state.page = 'DRIVEAROUND'
 if 'step' not in st.session_state: st.session_state.step = 'variety'
 if 'task_step' not in st.session_state: st.session_state.task_step = 'block'
@@ -160,13 +232,28 @@ if 'view_mode' not in st.session_state: st.session_state.view_mode = 'pending'
 # --- 6. SIDEBAR ---
 with st.sidebar:
     st.markdown("<h2 style='text-align:center; color:#00D08E;'>GNC</h2>", unsafe_allow_html=True)
-    if st.button("🔄 REFRESH DATA", use_container_width=True):
-        st.cache_data.clear()
+    if button("🔄 REFRESH DATA", use_container_width=True):
+        get_store().refresh(force=True)
         st.rerun()
+    with st.expander("SOURCES"):
+        for src, err in get_store().sync.errors.items():
+            if button(f"↻ {src}", key=f"sync_{src}"):
+                get_store().refresh([src])
+                st.rerun()
+            if err: st.caption(f"⚠️ {err}")
+    st.caption(f"Updated {fmt_age(get_store().age())}")
+    pending = get_write_queue().pending_count()
+    if pending: st.caption(f"⏳ {pending} edit(s) waiting to sync")
+    if get_store().rules.error: st.caption(f"⚠️ Rules not applied: {get_store().rules.error}")
+    # Admin timing panel: open the app with ?admin=1
+    if st.query_params.get("admin") == "1": st.session_state.admin = True
+    if st.session_state.get('admin'):
+        with st.expander("⏱ TIMINGS"):
+            st.dataframe(pd.DataFrame(perf_stats()), hide_index=True, use_container_width=True)
     st.markdown("---")
     nav_pages = ["OVERVIEW", "DRIVEAROUND", "MYTASKS", "SALESTEAM", "INVENTORYTEAM", "SOC", "SALESINVTRACKING", "WEATHER", "CONTACT"]
     for p in nav_pages:
-        if st.button(p, key=f"nav_{p}"):
+        if button(p, key=f"nav_{p}"):
             st.session_state.page = p
             st.session_state.step = 'variety'
             st.session_state.task_step = 'block'
@@ -175,9 +262,16 @@ with st.sidebar:
             st.rerun()
 
 # --- 7. MAIN WORKSPACE ---
-df, sales_notes_map = load_gnc_data()
+data = load_gnc_data()
+df, sales_notes = data.df, data.sales_notes
+if not df.empty and get_store().offline():
+    st.warning(f"📡 Offline copy — data from {fmt_age(get_store().age())}. Reconnecting in the background.")
 
-with st.container():
+# Each rerun is timed as one span named after the page/step it renders
+view = {"MYTASKS": st.session_state.task_step, "DRIVEAROUND": st.session_state.step, "SALESTEAM": st.session_state.sales_stage}.get(st.session_state.page)
+rerun = page_span(f"page.{st.session_state.page}" + (f".{view}" if view else ""), version=data.version)
+
+with st.container(), rerun:
     if df.empty:
         st.info("Waiting for data... (If stuck, hit Refresh)")
     else:
@@ -186,85 +280,69 @@ with st.container():
             if st.session_state.sales_stage == 'select_member':
                 st.markdown("## SALES TEAM")
                 cols = st.columns(2)
-                team = ["Dylan", "Zoe", "Morgan", "Kayla"]
+                team = data.rules.names()
                 for i, member in enumerate(team):
                     with cols[i % 2]:
-                        if st.button(member, key=f"team_{member}"):
+                        if button(member, key=f"team_{member}"):
                             st.session_state.user_name = member.upper()
                             st.session_state.sales_stage = 'select_status'; st.rerun()
 
             elif st.session_state.sales_stage == 'select_status':
                 st.markdown(f"## {st.session_state.user_name}")
-                if st.button("PENDING TASKS"):
+                counts = data.tasks.counts(st.session_state.user_name)
+                if button(f"PENDING TASKS ({counts['pending']})"):
                     st.session_state.page = "MYTASKS"; st.session_state.view_mode = "pending"; st.session_state.task_step = 'block'; st.rerun()
-                if st.button("COMPLETED TASKS"):
+                if button(f"COMPLETED TASKS ({counts['complete']})"):
                     st.session_state.page = "MYTASKS"; st.session_state.view_mode = "complete"; st.session_state.task_step = 'block'; st.rerun()
                 st.markdown("<br>", unsafe_allow_html=True)
-                if st.button("⬅️ BACK"): st.session_state.sales_stage = 'select_member'; st.rerun()
+                if button("⬅️ BACK"): st.session_state.sales_stage = 'select_member'; st.rerun()
 
         # --- MYTASKS (DATA ENTRY) ---
         elif st.session_state.page == "MYTASKS":
-            dylan_heavy = ["#7", "#10", "#15", "#25", "#45", "7DP"]
-            if st.session_state.user_name == "DYLAN":
-                my_data = df[(df['CONTSIZE'].isin(dylan_heavy)) | (df['SALES_ASSIGNEDTO'].str.upper() == "DYLAN")]
-            else:
-                my_data = df[df['SALES_ASSIGNEDTO'].str.upper() == st.session_state.user_name]
-
-            if st.session_state.view_mode == "complete":
-                my_data = my_data[my_data['STATUS'] == 'COMPLETE']
-            else:
-                my_data = my_data[my_data['STATUS'] != 'COMPLETE']
+            tasks = data.tasks
+            user, mode = st.session_state.user_name, st.session_state.view_mode
 
             # STEP 1: SELECT BLOCK
             if st.session_state.task_step == 'block':
                 st.markdown(f"## {st.session_state.user_name} TASKS")
-                if my_data.empty: st.info("No tasks found.")
+                blocks = tasks.blocks(user, mode)
+                rerun.set(rows=sum(blocks.values()))
+                if not blocks: st.info("No tasks found.")
                 else:
-                    blocks = my_data.groupby('BLOCKALPHA').size().reset_index(name='counts')
-                    for _, row in blocks.iterrows():
+                    for blk, n in blocks.items():
                         # Sleek Layout for Block Buttons
-                        if st.button(f"{row['BLOCKALPHA']} ({row['counts']} Trees)", key=f"blk_{row['BLOCKALPHA']}"):
-                            st.session_state.sel_block = row['BLOCKALPHA']; st.session_state.task_step = 'location'; st.rerun()
+                        if button(f"{blk} ({n} Trees)", key=f"blk_{blk}"):
+                            st.session_state.sel_block = blk; st.session_state.task_step = 'location'; st.rerun()
 
             # STEP 2: SELECT LOCATION
             elif st.session_state.task_step == 'location':
-                if st.button("⬅️ BACK"): st.session_state.task_step = 'block'; st.rerun()
+                if button("⬅️ BACK"): st.session_state.task_step = 'block'; st.rerun()
                 st.markdown(f"## BLOCK {st.session_state.sel_block}")
-                loc_data = my_data[my_data['BLOCKALPHA'] == st.session_state.sel_block]
-                locs = loc_data.groupby('LOCATIONCODE').size().reset_index(name='counts')
-                for _, row in locs.iterrows():
-                    if st.button(f"{row['LOCATIONCODE']} ({row['counts']})", key=f"loc_{row['LOCATIONCODE']}"):
-                        st.session_state.sel_loc = row['LOCATIONCODE']; st.session_state.task_step = 'list_items'; st.rerun()
+                locs = tasks.locations(user, mode, st.session_state.sel_block)
+                rerun.set(rows=sum(locs.values()))
+                for loc, n in locs.items():
+                    if button(f"{loc} ({n})", key=f"loc_{loc}"):
+                        st.session_state.sel_loc = loc; st.session_state.task_step = 'list_items'; st.rerun()
 
             # STEP 3: LIST ITEMS (THE MENU)
             elif st.session_state.task_step == 'list_items':
-                if st.button("⬅️ BACK"): st.session_state.task_step = 'location'; st.rerun()
+                if button("⬅️ BACK"): st.session_state.task_step = 'location'; st.rerun()
                 st.markdown(f"## {st.session_state.sel_block} - {st.session_state.sel_loc}")
                 
-                final = my_data[(my_data['BLOCKALPHA'] == st.session_state.sel_block) & 
-                                (my_data['LOCATIONCODE'] == st.session_state.sel_loc)]
+                final = tasks.rows(user, mode, st.session_state.sel_block, st.session_state.sel_loc)
                 
-                # Render list as nice cards
-                for idx, row in final.iterrows():
-                    # HTML Card for Visuals
-                    card_html = f"""
-                    <div class="list-card">
-                        <div class="list-card-title">{row.get('COMMONNAME')}</div>
-                        <div class="list-card-sub">{row.get('CONTSIZE')} | {row.get('LOTCODE')}</div>
-                        <div class="list-card-tags">
-                            PRIORITY: {row.get('PRIORITY')} &nbsp;&bull;&nbsp; PTR: {row.get('PTRAVAILABLE')}
-                        </div>
-                    </div>
-                    """
-                    st.markdown(card_html, unsafe_allow_html=True)
-                    
+                # Render the page of cards as one HTML block; only the picked row gets a widget
+                page, start = page_slice(final, f"pg_{st.session_state.sel_block}_{st.session_state.sel_loc}")
+                rerun.set(rows=len(final))
+                st.markdown(cards_html(page, start, sub=['CONTSIZE', 'LOTCODE'], tags=[('PRIORITY', 'PRIORITY'), ('PTR', 'PTRAVAILABLE')]), unsafe_allow_html=True)
+                if not page.empty:
+                    labels = item_labels(page, start, ['COMMONNAME', 'LOTCODE'])
+                    pick = selectbox("ITEM", options=list(labels), format_func=labels.get, key=f"pick_{st.session_state.sel_block}_{st.session_state.sel_loc}_{start}")
                     # Full-Width Action Button
-                    if st.button("OPEN ITEM ➤", key=f"open_{idx}", type="secondary"):
-                        st.session_state.sel_item_idx = idx
+                    if button("OPEN ITEM ➤", type="secondary"):
+                        st.session_state.sel_item_idx = pick
                         st.session_state.task_step = 'edit_item'
                         st.rerun()
-                    
-                    st.markdown("<div style='margin-bottom:12px'></div>", unsafe_allow_html=True)
 
             # STEP 4: EDIT ITEM (THE COMMAND CENTER)
             elif st.session_state.task_step == 'edit_item':
@@ -272,7 +350,8 @@ with st.container():
                 if idx not in df.index:
                     st.error("Item lost. Go back."); st.stop()
                 
-                row = df.loc[idx]
+                row = display_row(df.loc[idx])
+                rerun.set(rows=1)
                 item_code = str(row.get('ITEMCODE', '')).strip()
 
                 # --- 1. THE HUD HEADER ---
@@ -306,27 +385,24 @@ with st.container():
                 
                 c1, c2 = st.columns(2)
                 with c1:
-                    caliper = st.text_input("CALIPER", value=str(row.get('CALIPER','')), key=f"cal_{idx}")
+                    caliper = text_input("CALIPER", value=str(row.get('CALIPER','')), key=f"cal_{idx}")
                     # Match Logic
-                    match_options = [str(i) for i in range(0, 105, 5)]
-                    curr_match = str(row.get('MATCH_PCT', '')).strip()
-                    if curr_match and curr_match not in match_options: match_options = [curr_match] + match_options
-                    midx = match_options.index(curr_match) if curr_match in match_options else 0
-                    match_pct = st.selectbox("MATCH %", options=match_options, index=midx, key=f"match_{idx}")
+                    match_options, midx = match_choices(row.get('MATCH_PCT', ''))
+                    match_pct = selectbox("MATCH %", options=match_options, index=midx, key=f"match_{idx}")
                     
                     # Note Logic
                     curr_note = str(row.get('LOC_SALESNOTE', '')).strip()
-                    note_opts = sales_notes_map.get(item_code, [])
-                    opts = [""] + note_opts
-                    if curr_note and curr_note not in opts: opts.append(curr_note)
-                    loc_note = st.selectbox("SALES NOTE", options=opts, index=opts.index(curr_note) if curr_note in opts else 0, key=f"lnote_{idx}")
+                    opts = sales_notes.options(norm_key(item_code))
+                    nidx = sales_notes.slot(norm_key(item_code), curr_note)
+                    if nidx is None: opts = opts + [curr_note]; nidx = len(opts) - 1
+                    loc_note = selectbox("SALES NOTE", options=opts, index=nidx, key=f"lnote_{idx}")
 
                 with c2:
-                    spec = st.text_input("SPEC", value=str(row.get('SPEC','')), key=f"spec_{idx}")
-                    prime_qty = st.text_input("PRIME QTY", value=str(row.get('PRIME_QTY','')), key=f"prime_{idx}")
-                    comments = st.text_input("COMMENTS", value=str(row.get('LOC_COMMENTS','')), key=f"cmts_{idx}")
+                    spec = text_input("SPEC", value=str(row.get('SPEC','')), key=f"spec_{idx}")
+                    prime_qty = text_input("PRIME QTY", value=str(row.get('PRIME_QTY','')), key=f"prime_{idx}")
+                    comments = text_input("COMMENTS", value=str(row.get('LOC_COMMENTS','')), key=f"cmts_{idx}")
 
-                pic_note = st.text_input("PIC NOTE", value=str(row.get('PIC_NOTE','')), key=f"pnote_{idx}")
+                pic_note = text_input("PIC NOTE", value=str(row.get('PIC_NOTE','')), key=f"pnote_{idx}")
 
                 st.markdown("<br>", unsafe_allow_html=True)
                 
@@ -334,11 +410,18 @@ with st.container():
                 # Buttons layout: 1 column for Back, 2 columns for Save to make Save bigger
                 b1, b2 = st.columns([1, 2])
                 with b1:
-                    if st.button("⬅️ CANCEL"): 
+                    if button("⬅️ CANCEL"): 
                         st.session_state.task_step = 'list_items'; st.rerun()
                 with b2:
-                    if st.button("✅ SAVE & FINISH", type="primary"):
-                        st.warning("⚠️ Saving disabled for 24h (Google API Quota Limit).")
+                    if button("✅ SAVE & FINISH", type="primary"):
+                        edits = {'CALIPER': caliper, 'MATCH_PCT': match_pct, 'LOC_SALESNOTE': loc_note, 'SPEC': spec, 'PRIME_QTY': prime_qty, 'LOC_COMMENTS': comments, 'PIC_NOTE': pic_note}
+                        changed = changed_cells(row, edits)
+                        if changed:
+                            key, dup = row_identity(df, idx)
+                            get_write_queue().record(key, dup, changed)
+                            get_store().sync.patch(idx, changed)
+                            st.toast(f"Saved {len(changed)} field(s) — syncing to sheet")
+                        st.session_state.task_step = 'list_items'; st.rerun()
 
                 st.markdown("<br>", unsafe_allow_html=True)
                 # Toggle Full Info
@@ -354,42 +437,77 @@ with st.container():
                 cols = st.columns(5)
                 for i, s in enumerate(row_labels):
                     with cols[i]:
-                        if st.button(s, key=f"btn_{s}", use_container_width=True):
+                        if button(s, key=f"btn_{s}", use_container_width=True):
                             if s == "ALL" or s == "CLEAR": st.session_state.active_seasons = set()
                             else:
                                 if s in st.session_state.active_seasons: st.session_state.active_seasons.remove(s)
                                 else: st.session_state.active_seasons.add(s)
                             st.rerun()
 
-            f_df = df.copy()
-            if st.session_state.active_seasons:
-                f_df = f_df[f_df['SEASON'].isin(st.session_state.active_seasons)]
+            drive = data.drive
+            seasons = st.session_state.active_seasons
 
             if st.session_state.step == 'variety':
                 st.markdown("<hr>", unsafe_allow_html=True)
-                search = st.text_input("SEARCH VARIETY:", placeholder="Type name...")
-                names = sorted([n for n in f_df['COMMONNAME'].unique() if n.strip()])
-                filtered = [n for n in names if search.lower() in n.lower()]
+                search = text_input("SEARCH VARIETY:", placeholder="Type name...")
+                if st.session_state.get('var_query') != (search, frozenset(seasons)):
+                    st.session_state.var_query = (search, frozenset(seasons)); st.session_state.var_limit = VARIETY_PAGE
+                filtered, total = drive.search(seasons, search, limit=st.session_state.var_limit)
+                rerun.set(rows=total)
                 for n in filtered:
-                    if st.button(n, key=f"var_{n}"):
+                    if button(n, key=f"var_{n}"):
                         st.session_state.sel_variety = n; st.session_state.step = 'size'; st.rerun()
+                if total > len(filtered):
+                    if button(f"SHOW MORE ({len(filtered)} OF {total})", key="var_more"):
+                        st.session_state.var_limit += VARIETY_PAGE; st.rerun()
             
             elif st.session_state.step == 'size':
-                if st.button("⬅️ BACK"): st.session_state.step = 'variety'; st.rerun()
+                if button("⬅️ BACK"): st.session_state.step = 'variety'; st.rerun()
                 st.markdown(f"### {st.session_state.sel_variety}")
-                v_data = f_df[f_df['COMMONNAME'] == st.session_state.sel_variety]
-                sizes = sorted(v_data['CONTSIZE'].unique())
+                sizes = drive.sizes(seasons, st.session_state.sel_variety)
+                rerun.set(rows=len(sizes))
                 for s in sizes:
-                    if st.button(f"SIZE: {s}", key=f"sz_{s}"):
+                    if button(f"SIZE: {s}", key=f"sz_{s}"):
                         st.session_state.sel_size = s; st.session_state.step = 'data'; st.rerun()
 
             elif st.session_state.step == 'data':
-                if st.button("⬅️ BACK"): st.session_state.step = 'size'; st.rerun()
-                final = f_df[(f_df['COMMONNAME'] == st.session_state.sel_variety) & (f_df['CONTSIZE'] == st.session_state.sel_size)]
-                for _, row in final.iterrows():
-                    header = f"{row.get('COMMONNAME')} / {row.get('CONTSIZE')} / {row.get('LOCATIONCODE')}"
-                    with st.expander(header):
-                        for c, v in row.items(): st.write(f"**{c}:** {v}")
+                if button("⬅️ BACK"): st.session_state.step = 'size'; st.rerun()
+                final = drive.rows(seasons, st.session_state.sel_variety, st.session_state.sel_size)
+                page, start = page_slice(final, f"pg_{st.session_state.sel_variety}_{st.session_state.sel_size}_{sorted(seasons)}")
+                rerun.set(rows=len(final))
+                st.markdown(cards_html(page, start, sub=['CONTSIZE', 'LOCATIONCODE'], tags=[('SEASON', 'SEASON'), ('PTR', 'PTRAVAILABLE')]), unsafe_allow_html=True)
+                if not page.empty:
+                    labels = item_labels(page, start, ['LOCATIONCODE', 'LOTCODE'])
+                    pick = selectbox("DETAILS", options=[None] + list(labels), format_func=lambda i: "—" if i is None else labels[i])
+                    # Only the opened row is expanded
+                    if pick is not None:
+                        st.markdown("  \n".join(f"**{c}:** {v}" for c, v in display_row(final.loc[pick]).items()))
+
+        # --- OVERVIEW / SALES INVENTORY TRACKING: slices of the per-version cube, never the frame ---
+        elif st.session_state.page == "OVERVIEW":
+            cube = data.cube
+            st.markdown("## OVERVIEW")
+            f = season_filter(cube, "ov_season")
+            st.markdown(hud_totals("ALL STOCK", f.get('SEASON', "ALL SEASONS"), cube.rollup(**f)), unsafe_allow_html=True)
+            by_block, by_size = cube.rollup(['BLOCKALPHA'], **f), cube.rollup(['CONTSIZE'], **f)
+            rerun.set(rows=len(by_block) + len(by_size))
+            st.markdown("### BY BLOCK")
+            st.dataframe(cube_table(by_block), hide_index=True, use_container_width=True)
+            st.markdown("### BY SIZE")
+            st.dataframe(cube_table(by_size), hide_index=True, use_container_width=True)
+
+        elif st.session_state.page == "SALESINVTRACKING":
+            cube = data.cube
+            st.markdown("## SALES INVENTORY TRACKING")
+            f = season_filter(cube, "sit_season")
+            by_rep = cube.rollup(['SALES_ASSIGNEDTO'], **f)
+            st.dataframe(cube_table(by_rep), hide_index=True, use_container_width=True)
+            rep = selectbox("REP", cube.values('SALES_ASSIGNEDTO'), key="sit_rep")
+            if rep:
+                detail = cube.rollup(['BLOCKALPHA', 'CONTSIZE'], SALES_ASSIGNEDTO=rep, **f)
+                st.markdown(hud_totals(rep, f.get('SEASON', "ALL SEASONS"), cube.rollup(SALES_ASSIGNEDTO=rep, **f)), unsafe_allow_html=True)
+                st.dataframe(cube_table(detail), hide_index=True, use_container_width=True)
+            rerun.set(rows=len(by_rep))
 
         elif st.session_state.page == "WEATHER":
             components.html('<div style="background-color: white; padding: 10px; border: 2px solid #006847; border-radius: 12px; font-family: sans-serif; text-align: center;"><h1 style="color: #006847; margin: 0; font-size: 1.1rem;">46°F</h1><p style="color: #006847; font-weight: bold; font-size: 0.8rem;">Park Hill, OK</p></div>', height=70)
@@ -0,0 +1,255 @@
+"""Reproducible benchmarks for the LeafLink data path (no Streamlit needed).
+
+Generates synthetic Inventory_Drive_Around / S1_SalesNotes sheets with the
+real REQUIRED_COLS schema at each requested size, times each stage against the
+pre-index code it replaced, records peak traced memory, and writes JSON that
+``--compare`` can diff against an earlier run.
+
+    python leaflink_bench.py --rows 1000,10000,100000 --out bench_results/run.json
+    python leaflink_bench.py --rows 100000 --compare bench_results/run.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from leaflink_data import (HEAVY_SIZES, INVENTORY, REQUIRED_COLS, AggregateCube, DriveIndex, NameSearch, NotesIndex, SheetSync, TaskIndex,
+                           clean_columns, normalize_inventory, note_column)
+
+# --- 1. SYNTHETIC SHEETS ---
+SEASONS = ["F1", "S1", "U1", "U2", "U3", "X", "Y", "Z"]
+SIZES = ["#1", "#3", "#5", "#7", "#10", "#15", "#20", "#25", "#30", "#45", "#65", "#100", "7DP", "B&B", "BR"]
+TEAM = ["DYLAN", "ZOE", "MORGAN", "KAYLA"]
+GENUS = ["Maple", "Oak", "Elm", "Redbud", "Dogwood", "Holly", "Spruce", "Pine", "Magnolia", "Viburnum", "Hydrangea", "Juniper", "Boxwood", "Arborvitae", "Crape Myrtle"]
+CULTIVAR = ["Red", "Sugar", "Autumn Blaze", "October Glory", "Forest Pansy", "Kousa", "Nellie Stevens", "Colorado Blue", "Little Gem", "Green Giant",
+            "Limelight", "Blue Point", "Wintergreen", "Emerald", "Natchez", "Bur", "Shumard", "Lacebark", "Japanese", "Weeping"]
+NOTES = ["Hold for {}", "Tag for {} job", "Ship w/ {} order", "Needs prune before {}", "Reserved: {}", "Sub OK for {}"]
+FORMS = ["", " Multi", " Std", " Clump", " Patio", " Column", " Dwarf", " Select", " Improved", " Compact"]
+CUSTOMERS = ["Tulsa Parks", "OKC Landscape", "Riverbend", "Green Acres", "Prairie Design", "Cherokee Nursery", "Lakeside HOA", "Broken Arrow"]
+
+
+def synthetic_sheets(rows, seed=0):
+    """(inventory, notes) frames shaped like what read_csv gets from the gviz export."""
+    rng = np.random.default_rng(seed)
+    # ~1 variety per 20 rows, capped near the real catalogue (~3000); zipf-skewed so a few dominate
+    names = np.array([f"{g}, {c}{v}" for v in FORMS for g in GENUS for c in CULTIVAR], dtype=object)
+    names = names[rng.permutation(len(names))[:int(min(len(names), max(50, rows // 20)))]]
+    blocks = np.array([f"{a}{b}" for a in "ABCDEFGHJK" for b in ("", "2", "3")], dtype=object)  # 30 blocks
+    block = rng.choice(blocks, rows)
+    bay = rng.integers(1, int(max(5, min(120, rows // 300))) + 1, rows)
+    items = rng.integers(100000, 100000 + max(100, rows // 4), rows)
+
+    def blanks(values, frac):
+        values = values.astype(object)
+        values[rng.random(rows) < frac] = np.nan
+        return values
+
+    inv = pd.DataFrame({
+        'ITEMCODE': items,
+        'LOTCODE': rng.integers(1, 10 ** 6, rows),
+        'LOCATIONCODE': block + "-" + bay.astype(str),
+        'BLOCKALPHA': block,
+        'SEASON': rng.choice(SEASONS, rows, p=[0.2, 0.25, 0.15, 0.1, 0.05, 0.1, 0.1, 0.05]),
+        'CONTSIZE': rng.choice(SIZES, rows),
+        'COMMONNAME': names[rng.zipf(1.3, rows) % len(names)],
+        'SALES_ASSIGNEDTO': blanks(rng.choice(TEAM, rows), 0.4),
+        'STATUS': blanks(np.full(rows, "COMPLETE", dtype=object), 0.7),
+        'PRIORITY': blanks(rng.integers(1, 6, rows), 0.5),
+        'PRIME_QTY': blanks(rng.integers(0, 500, rows), 0.3),
+        'PTRAVAILABLE': blanks(rng.integers(0, 500, rows), 0.2),
+        'MATCH_PCT': blanks(rng.integers(0, 21, rows) * 5, 0.6),
+        'CALIPER': blanks(rng.choice(["1.5\"", "2\"", "2.5\"", "3\"", "4\""], rows), 0.5),
+        'SPEC': blanks(rng.choice(["Full", "Std", "Clump", "Multi"], rows), 0.6),
+        'S_LTS': blanks(rng.integers(0, 300, rows), 0.3),
+    })
+    # columns the data path never reads: mostly blank, like the sheet
+    for c in REQUIRED_COLS:
+        if c not in inv.columns: inv[c] = blanks(np.full(rows, "x", dtype=object), 0.9)
+    note_rows = max(10, rows // 2)
+    notes = pd.DataFrame({
+        'ITEMCODE': rng.choice(items, note_rows),
+        'SALESNOTE': [NOTES[i % len(NOTES)].format(CUSTOMERS[j]) for i, j in zip(rng.integers(0, 99, note_rows), rng.integers(0, len(CUSTOMERS), note_rows))],
+    })
+    return inv, notes
+
+
+# --- 2. PRE-INDEX BASELINES (the code paths these indexes replaced) ---
+def legacy_normalize(df):
+    df.columns = df.columns.str.strip().str.upper()
+    missing = [c for c in REQUIRED_COLS if c not in df.columns]
+    if missing: df[pd.Index(missing)] = ""
+    return df.fillna("").astype(str)
+
+
+def legacy_mytasks(df, user, status):
+    heavy = HEAVY_SIZES if user == "DYLAN" else None
+    m = df[(df['CONTSIZE'].isin(heavy)) | (df['SALES_ASSIGNEDTO'].str.upper() == user)] if heavy else df[df['SALES_ASSIGNEDTO'].str.upper() == user]
+    m = m[m['STATUS'] == 'COMPLETE'] if status == "complete" else m[m['STATUS'] != 'COMPLETE']
+    blocks = m.groupby('BLOCKALPHA').size()
+    if blocks.empty: return 0
+    b = blocks.index[0]
+    locs = m[m['BLOCKALPHA'] == b].groupby('LOCATIONCODE').size()
+    return len(m[(m['BLOCKALPHA'] == b) & (m['LOCATIONCODE'] == locs.index[0])])
+
+
+def indexed_mytasks(tasks, user, status):
+    blocks = tasks.blocks(user, status)
+    if not blocks: return 0
+    b = next(iter(blocks))
+    return len(tasks.rows(user, status, b, next(iter(tasks.locations(user, status, b)))))
+
+
+def legacy_drivearound(df, seasons):
+    f_df = df.copy()
+    if seasons: f_df = f_df[f_df['SEASON'].isin(seasons)]
+    names = sorted([n for n in f_df['COMMONNAME'].unique() if n.strip()])
+    return sorted(f_df[f_df['COMMONNAME'] == names[0]]['CONTSIZE'].unique()) if names else []
+
+
+def legacy_overview(df, season):
+    f = df[df['SEASON'] == season] if season else df
+    num = lambda c: pd.to_numeric(f[c], errors='coerce').fillna(0)
+    parts = f.assign(PRIME=num('PRIME_QTY'), PTR=num('PTRAVAILABLE'), DONE=f['STATUS'] == 'COMPLETE')
+    return [parts.groupby(by)[['PRIME', 'PTR', 'DONE']].sum() for by in ('BLOCKALPHA', 'CONTSIZE')]
+
+
+def cube_overview(cube, season):
+    f = {'SEASON': season} if season else {}
+    return [cube.rollup([by], **f) for by in ('BLOCKALPHA', 'CONTSIZE')]
+
+
+def legacy_notes_map(notes_df):
+    if notes_df.empty: return {}
+    notes_df = clean_columns(notes_df)
+    note_col = note_column(notes_df)
+    if not note_col: return {}
+    return notes_df.groupby('ITEMCODE')[note_col].apply(lambda x: list(x.dropna().astype(str))).to_dict()
+
+
+def legacy_note_lookup(notes_map, probes):
+    for k, note in probes:
+        opts = [""] + notes_map.get(k, [])
+        opts.index(note) if note in opts else 0
+
+
+def indexed_note_lookup(index, probes):
+    for k, note in probes:
+        index.options(str(k)); index.slot(str(k), note)
+
+
+def legacy_search(names, query):
+    return [n for n in names if query.lower() in n.lower()]
+
+
+# --- 3. HARNESS ---
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'median_s': statistics.median(times), 'min_s': min(times), 'peak_mb': round(peak / 2 ** 20, 2)}
+
+
+def run_size(rows, repeat, seed=0):
+    inv, notes = synthetic_sheets(rows, seed)
+    legacy_df = legacy_normalize(inv.copy())
+    typed = normalize_inventory(inv.copy())
+    frame_mb = {v: round(f.memory_usage(deep=True).sum() / 2 ** 20, 2) for v, f in (("legacy", legacy_df), ("typed", typed))}
+    tasks, drive, cube = TaskIndex(typed), DriveIndex(typed), AggregateCube(typed)
+    notes_map, notes_index = legacy_notes_map(notes.copy()), NotesIndex.build(notes.copy())
+    probes = [(k, v[-1] if v else "") for k, v in list(notes_map.items())[:1000]]
+    edit_rows = typed.iloc[:max(1, rows // 100)]
+    names = drive.names(())
+    queries = ["maple", "red", "ok", "autumn blaze", "mapel", "zz"]
+    season_sets = [(), ("F1",), ("S1", "U1"), ("F1",), ()]
+    changed = inv.copy()
+    touched = np.random.default_rng(seed + 1).choice(rows, max(1, rows // 100), replace=False)
+    changed.loc[touched, 'PRIME_QTY'] = 999
+    sync = SheetSync(fetch=lambda url, **kw: inv.copy() if INVENTORY in url else pd.DataFrame())
+    sync.sync([INVENTORY])
+
+    def resync():
+        sync.fetch = lambda url, **kw: changed.copy()
+        sync.sync([INVENTORY])
+        sync.fetch = lambda url, **kw: inv.copy()
+        sync.sync([INVENTORY])
+
+    cases = [
+        ("load.normalize", "legacy", lambda: legacy_normalize(inv.copy())),
+        ("load.normalize", "typed", lambda: normalize_inventory(inv.copy())),
+        ("load.resync_1pct_x2", "sync", resync),
+        ("mytasks.index_build", "typed", lambda: TaskIndex(typed)),
+        ("mytasks.drilldown_x8", "legacy", lambda: [legacy_mytasks(legacy_df, u, s) for u in TEAM for s in ("pending", "complete")]),
+        ("mytasks.drilldown_x8", "indexed", lambda: [indexed_mytasks(tasks, u, s) for u in TEAM for s in ("pending", "complete")]),
+        ("drivearound.index_build", "typed", lambda: DriveIndex(typed)),
+        ("drivearound.season_x5", "legacy", lambda: [legacy_drivearound(legacy_df, set(s)) for s in season_sets]),
+        ("drivearound.season_x5", "cold", lambda: (drive.views.clear(), [drive.sizes(s, (drive.names(s) or [None])[0]) for s in season_sets])),
+        ("drivearound.season_x5", "indexed", lambda: [drive.sizes(s, (drive.names(s) or [None])[0]) for s in season_sets]),
+        ("overview.cube_build", "typed", lambda: AggregateCube(typed)),
+        ("overview.rollup_x4", "legacy", lambda: [legacy_overview(legacy_df, s) for s in (None, "F1", "S1", None)]),
+        ("overview.rollup_x4", "cube", lambda: (cube.views.clear(), [cube_overview(cube, s) for s in (None, "F1", "S1", None)])),
+        ("overview.edit_1pct", "delta", lambda: cube.update(edit_rows, edit_rows.assign(STATUS='COMPLETE'))),
+        ("search.build", "trigram", lambda: NameSearch(names)),
+        ("search.query_x6", "legacy", lambda: [legacy_search(sorted([n for n in legacy_df['COMMONNAME'].unique() if n.strip()]), q) for q in queries]),
+        ("search.query_x6", "indexed", lambda: (drive.view(()).searches.clear(), [drive.search((), q) for q in queries])),
+        ("notes.build", "legacy", lambda: legacy_notes_map(notes.copy())),
+        ("notes.build", "indexed", lambda: NotesIndex.build(notes.copy())),
+        ("notes.lookup_x1000", "legacy", lambda: legacy_note_lookup(notes_map, probes)),
+        ("notes.lookup_x1000", "indexed", lambda: indexed_note_lookup(notes_index, probes)),
+    ]
+    out = []
+    for name, variant, fn in cases:
+        r = measure(fn, repeat)
+        out.append({'name': name, 'variant': variant, 'rows': rows, **{k: round(v, 6) if k != 'peak_mb' else v for k, v in r.items()}})
+        if name == "load.normalize": out[-1]['frame_mb'] = frame_mb[variant]
+        print(f"{rows:>8} {name:<26} {variant:<8} {r['median_s'] * 1000:10.2f} ms  peak {r['peak_mb']:8.2f} MB"
+              + (f"  frame {out[-1]['frame_mb']:8.2f} MB" if 'frame_mb' in out[-1] else ""), file=sys.stderr)
+    return out
+
+
+def meta():
+    try: commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError: commit = ""
+    return {'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"), 'commit': commit, 'python': platform.python_version(),
+            'pandas': pd.__version__, 'numpy': np.__version__, 'platform': platform.platform()}
+
+
+def compare(new, old_path):
+    with open(old_path) as f: old = {(r['name'], r['variant'], r['rows']): r for r in json.load(f)['results']}
+    for r in new:
+        o = old.get((r['name'], r['variant'], r['rows']))
+        if o and o['median_s']:
+            print(f"{r['rows']:>8} {r['name']:<26} {r['variant']:<8} {o['median_s'] * 1000:10.2f} -> {r['median_s'] * 1000:10.2f} ms  x{r['median_s'] / o['median_s']:.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", default="1000,10000,100000", help="comma-separated sizes, up to 500000")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default=None, help="JSON output path (default bench_results/<timestamp>.json)")
+    ap.add_argument("--compare", default=None, help="earlier JSON run to diff against")
+    args = ap.parse_args()
+    results = []
+    for rows in (int(r) for r in args.rows.split(",")): results += run_size(rows, args.repeat, args.seed)
+    report = {'meta': meta(), 'results': results}
+    out = args.out or os.path.join("bench_results", report['meta']['timestamp'].replace(":", "") + ".json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f: json.dump(report, f, indent=2)
+    print(out)
+    if args.compare: compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1019 @@
+import json
+import os
+import re
+import threading
+import time
+from difflib import SequenceMatcher
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from leaflink_perf import span
+
+# --- 1. SHEET SOURCES ---
+SHEET_ID = "1FNuWtLD6okE7tOxD3dRcUXVWL9bwwSye1nhGSVDiiTs"
+GVIZ_BASE = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/gviz/tq"
+INVENTORY = "Inventory_Drive_Around"
+SALES_NOTES = "S1_SalesNotes"
+
+
+class Source:
+    """A sheet tab the loader pulls: per-request timeout in seconds and retries after the first try."""
+    __slots__ = ('name', 'timeout', 'retries')
+
+    def __init__(self, name, timeout=20, retries=2):
+        self.name, self.timeout, self.retries = name, timeout, retries
+
+
+# name -> Source. Inventory and sales notes have their own merge logic; any other registered
+# tab (SOC, SALESINVTRACKING, ...) is fetched alongside them and kept as-is in ``SheetSync.tabs``.
+SOURCES = {}
+
+
+def register_source(name, timeout=20, retries=2):
+    SOURCES[name] = Source(name, timeout, retries)
+    return SOURCES[name]
+
+
+register_source(INVENTORY, timeout=30)
+register_source(SALES_NOTES, timeout=15)
+
+REQUIRED_COLS = ['LOC_SALESNOTE', 'CALIPER', 'SPEC', 'LOC_COMMENTS', 'MATCH_PCT', 'PIC_NOTE', 'PRIME_QTY', 'PHOTO', 'STATUS', 'ITEMCODE', 'SALES_ASSIGNEDTO', 'SEASON', 'COMMONNAME', 'CONTSIZE', 'BLOCKALPHA', 'LOCATIONCODE', 'LOTCODE', 'PRIORITY', 'CURRENT_SALESNOTE', 'PTRAVAILABLE', 'S_LTS']
+ROW_KEY = ['ITEMCODE', 'LOTCODE', 'LOCATIONCODE']
+# If the sheet carries one of these, only rows newer than the snapshot are pulled
+MODIFIED_COLS = ['LAST_MODIFIED', 'MODIFIED_AT', 'UPDATED_AT']
+
+
+def gviz_url(sheet, query=None, base=GVIZ_BASE):
+    url = f"{base}?tqx=out:csv&sheet={quote(sheet)}"
+    if query: url += "&tq=" + quote(query)
+    return url
+
+
+class FetchError(RuntimeError):
+    """A source that still failed after its retries; the message says why."""
+
+
+class HttpFetcher:
+    """CSV fetches over one pooled HTTP session, shared by every source and every refresh.
+
+    Connections are kept alive between refreshes, responses are gzip-encoded,
+    and the body is streamed straight into ``read_csv``. Timeouts, connection
+    errors (also mid-body, where urllib3 raises its own exceptions rather than
+    requests') and 429/5xx answers are retried with exponential backoff; anything
+    else (a missing tab, an HTML error page) fails at once with ``FetchError``.
+    """
+
+    def __init__(self, pool=8, backoff=0.5):
+        import requests  # ships with streamlit; imported here so the benchmarks don't need it
+        import urllib3
+        self.retryable = (requests.RequestException, urllib3.exceptions.HTTPError)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers['Accept-Encoding'] = "gzip, deflate"
+        self.backoff = backoff
+
+    def __call__(self, url, timeout=20, retries=2):
+        for attempt in range(retries + 1):
+            if attempt: time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                with self.session.get(url, stream=True, timeout=timeout) as r:
+                    if r.status_code == 429 or r.status_code >= 500:
+                        err = f"HTTP {r.status_code}"; continue
+                    if r.status_code >= 400: raise FetchError(f"HTTP {r.status_code}")
+                    if "text/html" in r.headers.get('Content-Type', ""): raise FetchError("got an HTML page instead of CSV")
+                    r.raw.decode_content = True
+                    return pd.read_csv(r.raw)
+            except pd.errors.EmptyDataError: return pd.DataFrame()
+            except pd.errors.ParserError as e: raise FetchError(f"bad CSV: {e}") from e
+            except self.retryable as e: err = f"{type(e).__name__}: {e}"
+        raise FetchError(f"{err} (after {retries + 1} tries)")
+
+
+# --- 2. NORMALIZATION ---
+def clean_columns(df):
+    df.columns = df.columns.str.strip().str.upper()
+    return df
+
+
+# Column dtypes: categoricals for the low-cardinality fields, nullable floats for quantities
+# and percentages. Other text columns turn categorical once values repeat enough to pay off.
+# Missing cells stay missing (NA) and are blanked when rendered, see ``fmt``.
+CATEGORY_COLS = ['SEASON', 'STATUS', 'CONTSIZE', 'BLOCKALPHA', 'LOCATIONCODE', 'SALES_ASSIGNEDTO']
+NUMERIC_COLS = ['PRIME_QTY', 'PTRAVAILABLE', 'MATCH_PCT']
+
+
+def to_number(s):
+    if pd.api.types.is_numeric_dtype(s): return s.astype('Float64')
+    num = pd.to_numeric(s, errors='coerce')
+    bad = num.isna() & s.notna()
+    # only the cells that didn't parse as-is get the slower "80%" / "1,200" cleanup
+    if bad.any(): num[bad] = pd.to_numeric(s[bad].astype(str).str.replace(r'[%,\s]', '', regex=True).replace("", None), errors='coerce')
+    return num.astype('Float64')
+
+
+def apply_schema(df):
+    for c in df.columns:
+        s = df[c]
+        if c in NUMERIC_COLS: df[c] = to_number(s); continue
+        if pd.api.types.is_numeric_dtype(s) or pd.api.types.is_bool_dtype(s):
+            # codes read as numbers; a blank makes read_csv use floats, so whole floats go through
+            # Int64 and "3" reads the same whether or not its pull had a blank in that column
+            if pd.api.types.is_float_dtype(s) and (s.dropna() % 1 == 0).all(): s = s.astype('Int64')
+            s = s.astype('string')
+        df[c] = s.astype('category') if c in CATEGORY_COLS or s.nunique() < len(s) // 2 else s
+    return df
+
+
+def normalize_inventory(df):
+    if df.empty: return df
+    df = clean_columns(df)
+    missing = [c for c in REQUIRED_COLS if c not in df.columns]
+    if missing: df[pd.Index(missing)] = pd.NA
+    return apply_schema(df)
+
+
+def fmt(v):
+    # display form of a typed cell: NA -> "", whole floats without the trailing .0
+    if v is None or v is pd.NA or (isinstance(v, float) and v != v): return ""
+    if isinstance(v, float) and v.is_integer(): return str(int(v))
+    return str(v)
+
+
+def display_row(row):
+    return pd.Series({k: fmt(v) for k, v in row.items()}, dtype=object)
+
+
+def display_col(s):
+    # ``fmt`` for a whole column at once
+    if pd.api.types.is_float_dtype(s):
+        whole = (s.notna() & (s % 1 == 0)).fillna(False).astype(bool)
+        out = s.astype('string')
+        out[whole] = s[whole].astype('Int64').astype('string')
+        return out.fillna("").astype(object)
+    return s.astype(object).where(s.notna(), "").astype(str)
+
+
+def key_values(s):
+    # navigation keys (blocks, locations, names) as plain strings with "" for missing
+    return s.astype(object).where(s.notna(), "").values
+
+
+def note_column(notes_df):
+    if 'ITEMCODE' not in notes_df.columns: return None
+    note_cols = [c for c in notes_df.columns if 'NOTE' in c]
+    return note_cols[0] if note_cols else (notes_df.columns[1] if len(notes_df.columns) > 1 else None)
+
+
+def code_text(s):
+    # item/lot codes as bare text: "123.0" (a float read by read_csv) and "123" compare equal
+    return pd.Series(key_values(s), index=s.index).astype(str).str.strip().str.replace(r'^(-?\d+)\.0$', r'\1', regex=True)
+
+
+class NotesIndex:
+    """Sales-note choices per ITEMCODE, stored as integer codes into one de-duplicated note list.
+
+    ``codes[offsets[i]:offsets[i + 1]]`` are the notes of ``items[i]`` in sheet
+    order, and ``slot`` answers "where is this note in the item's options" in
+    O(1) for the SALES NOTE selectbox.
+    """
+
+    def __init__(self, notes=(), items=(), codes=(), offsets=(0,)):
+        self.notes = list(notes)
+        self.items = list(items)
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self._note_arr = np.array(self.notes, dtype=object)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self._item_id = {k: i for i, k in enumerate(self.items)}
+        self._note_id = {n: i for i, n in enumerate(self.notes)}
+        item_of = np.repeat(np.arange(len(self.items)), np.diff(self.offsets))
+        local = np.arange(len(self.codes)) - self.offsets[item_of] + 1  # +1: options start with ""
+        self._slot = dict(zip(zip(item_of.tolist(), self.codes.tolist()), local.tolist()))
+        self._options = {}  # item -> options list, filled on first lookup
+
+    @classmethod
+    def build(cls, notes_df):
+        if notes_df.empty: return cls()
+        notes_df = clean_columns(notes_df)
+        note_col = note_column(notes_df)
+        if not note_col: return cls()
+        pairs = pd.DataFrame({'item': code_text(notes_df['ITEMCODE']), 'note': notes_df[note_col]}).dropna(subset=['note'])
+        pairs['note'] = pairs['note'].astype(str)
+        pairs = pairs[pairs['item'] != ""].drop_duplicates()
+        item_ids, items = pd.factorize(pairs['item'], sort=True)
+        note_ids, notes = pd.factorize(pairs['note'])
+        order = np.argsort(item_ids, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(item_ids, minlength=len(items)))])
+        return cls(notes, items, note_ids[order], offsets)
+
+    def to_dict(self):
+        return {'notes': self.notes, 'items': self.items, 'codes': self.codes.tolist(), 'offsets': self.offsets.tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['notes'], d['items'], d['codes'], d['offsets']) if d else cls()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def options(self, item):
+        """SALES NOTE choices for the item, "" first. The list is shared between calls; don't modify it."""
+        opts = self._options.get(item)
+        if opts is None:
+            i = self._item_id.get(item)
+            opts = [""] if i is None else [""] + self._note_arr[self.codes[self.offsets[i]:self.offsets[i + 1]]].tolist()
+            if i is not None: self._options[item] = opts
+        return opts
+
+    def slot(self, item, note):
+        """Position of ``note`` in ``options(item)``, or None if it isn't one of them."""
+        if not note: return 0
+        i, c = self._item_id.get(item), self._note_id.get(note)
+        return None if i is None or c is None else self._slot.get((i, c))
+
+
+# --- 3. ROW IDENTITY ---
+def row_keys(df):
+    """uint64 per row from ITEMCODE/LOTCODE/LOCATIONCODE and its ordinal among repeats of that key,
+    plus whether any key repeats. Always hashed with the ordinal, so a key reads the same in every pull."""
+    kh = pd.util.hash_pandas_object(df[ROW_KEY], index=False)
+    dup = kh.groupby(kh.values).cumcount()
+    keys = pd.Index(pd.util.hash_pandas_object(pd.DataFrame({'k': kh.values, 'n': dup.values}), index=False).values)
+    return keys, bool(dup.any())
+
+
+def row_hashes(df):
+    return pd.Series(pd.util.hash_pandas_object(df, index=False).values, index=df.index)
+
+
+def col_letter(i):
+    s = ""
+    i += 1
+    while i: i, r = divmod(i - 1, 26); s = chr(65 + r) + s
+    return s
+
+
+def marker_literal(marker):
+    num = pd.to_numeric(pd.Series([marker]), errors='coerce').iloc[0]
+    if pd.notna(num): return str(num)
+    ts = pd.to_datetime(pd.Series([marker]), errors='coerce').iloc[0]
+    if pd.notna(ts): return f"datetime '{ts.strftime('%Y-%m-%d %H:%M:%S')}'"
+    return "'" + str(marker).replace("'", "") + "'"
+
+
+def max_marker(values):
+    values = values.dropna().astype(str)
+    values = values[values.str.strip() != ""]
+    if values.empty: return None
+    num = pd.to_numeric(values, errors='coerce')
+    if num.notna().all(): return values[num.idxmax()]
+    ts = pd.to_datetime(values, errors='coerce', format='mixed')
+    if ts.notna().all(): return values[ts.idxmax()]
+    return values.max()
+
+
+def align_dtypes(df, new):
+    # cast the incoming rows to the snapshot dtypes (categories widened) so updates and appends keep them
+    for c in df.columns:
+        a = df[c].dtype
+        if isinstance(a, pd.CategoricalDtype):
+            nc = new[c] if isinstance(new[c].dtype, pd.CategoricalDtype) else new[c].astype('category')
+            cats = a.categories.union(nc.cat.categories)
+            if not a.categories.equals(cats): df[c] = df[c].cat.set_categories(cats)
+            new[c] = nc.cat.set_categories(cats)
+        elif new[c].dtype != a: new[c] = new[c].astype(a)
+
+
+def write_frame(df, stem):
+    # Parquet keeps the categoricals and nullable dtypes; pickle only if pyarrow is missing
+    tmp = stem + ".tmp"
+    try:
+        df.to_parquet(tmp)
+        os.replace(tmp, stem + ".parquet")
+    except ImportError:
+        df.to_pickle(tmp)
+        os.replace(tmp, stem + ".pkl")
+
+
+def read_frame(stem):
+    if os.path.exists(stem + ".parquet"): return pd.read_parquet(stem + ".parquet")
+    return pd.read_pickle(stem + ".pkl")
+
+
+# --- 4. DELTA SYNC ---
+class SheetSync:
+    """Local snapshot of the sheets that merges only changed rows on each refresh.
+
+    Inventory rows are keyed on ITEMCODE/LOTCODE/LOCATIONCODE and compared by
+    content hash, so untouched rows keep their index labels (and any selection
+    pointing at them) across refreshes. Every merge that changes something
+    bumps ``version``; a refresh that finds nothing new leaves it alone.
+
+    Sources are fetched concurrently on a pool kept for the life of the sync,
+    through ``fetch(url, timeout=, retries=)`` (an ``HttpFetcher`` by default).
+    A source that fails keeps its last good data and reports why in ``errors``
+    without holding back the others.
+    """
+
+    def __init__(self, fetch=None, ttl=600, full_every=6, sources=None, base_url=GVIZ_BASE):
+        self.fetch = fetch or HttpFetcher()
+        self.ttl = ttl
+        self.full_every = full_every
+        self.sources = {s: SOURCES[s] for s in (sources or SOURCES)}
+        self.base_url = base_url
+        self.df = pd.DataFrame()
+        self.sales_notes = NotesIndex()
+        self.tabs = {}  # other registered sources, name -> frame as fetched
+        self.cube = AggregateCube()
+        self.version = 0
+        self.snapshot = (self.df, self.sales_notes, self.version, self.cube)  # swapped as one tuple so readers never see a mix
+        self.source_versions = {s: 0 for s in self.sources}
+        self.synced_at = {s: 0.0 for s in self.sources}
+        self.fetched_at = {s: 0.0 for s in self.sources}  # last fetch that actually returned data
+        self.errors = {s: None for s in self.sources}
+        self.last_changed = {s: 0 for s in self.sources}
+        self._executor = ThreadPoolExecutor(max_workers=max(2, len(self.sources)), thread_name_prefix="leaflink-fetch")
+        self._lock = threading.Lock()
+        self._patch_lock = threading.Lock()  # keeps df and cube in step between patch and merge
+        self._labels = pd.Series(dtype='int64')  # row key -> index label
+        self._dup_keys = False
+        self._hashes = pd.Series(dtype='uint64')  # index label -> content hash
+        self._raw_cols = []
+        self._notes_hash = None
+        self._tab_hashes = {}
+        self._inv_syncs = 0
+
+    def stale(self, source):
+        return time.time() - self.synced_at[source] >= self.ttl
+
+    def sync(self, sources=None, force=False):
+        """Refresh the given sources (default: all stale ones) and return rows changed per source."""
+        if sources is None: sources = list(self.sources) if force else [s for s in self.sources if self.stale(s)]
+        if not sources: return {}
+        with self._lock:
+            futures = {s: self._executor.submit(self._sync_source, s) for s in sources}
+            changed = {}
+            for s, f in futures.items():
+                try: changed[s] = f.result()
+                except Exception as e:
+                    # a source that breaks mid-merge keeps its previous data; the others still publish
+                    self.errors[s], changed[s] = f"{type(e).__name__}: {e}", 0
+            for s, n in changed.items():
+                # a failed source stays stale, so the refresh thread's next tick retries it
+                if self.errors[s] is None: self.synced_at[s] = time.time()
+                self.last_changed[s] = n
+                if n: self.source_versions[s] += 1
+            if any(changed.values()):
+                self.version += 1
+                self.snapshot = (self.df, self.sales_notes, self.version, self.cube)
+            return changed
+
+    def patch(self, label, values):
+        """Write edited cells straight into the live frame ahead of the sheet write-back.
+
+        This mutates the frame of the published snapshot in place, on purpose:
+        other sessions see the edit on their next rerun. Only edit columns
+        (``leaflink_writes.EDITABLE_COLS``) are expected here, none of which the
+        MYTASKS / DRIVEAROUND indexes are built on; a reader may catch a row
+        mid-patch, with some of its edited cells old and some new.
+
+        Row hashes are left alone, so a sync that still sees the old sheet values
+        doesn't revert the edit; once the write lands, the next sync picks the row
+        up as changed. A patch racing a merge can be lost, which is why callers
+        re-apply pending edits after each new version (``WriteQueue.overlay``).
+        The dashboard cube is moved by the edit in the same step.
+        """
+        with self._patch_lock:
+            df = self.df
+            if label not in df.index: return False
+            before = df.loc[[label]] if CUBE_COLS.intersection(values) else None
+            for c, v in values.items():
+                if c not in df.columns: continue
+                v = None if v is None or str(v).strip() == "" else v
+                if c in NUMERIC_COLS and v is not None: v = to_number(pd.Series([v])).iloc[0]
+                elif v is not None and isinstance(df[c].dtype, pd.CategoricalDtype) and v not in df[c].cat.categories: df[c] = df[c].cat.add_categories([v])
+                df.loc[label, c] = v
+            if before is not None: self.cube.update(before, df.loc[[label]])
+        return True
+
+    def _delta_query(self):
+        # a delta row can't know its ordinal among repeated keys, so repeats force full pulls
+        if self.df.empty or self._dup_keys or self._inv_syncs % self.full_every == 0: return None
+        col = next((c for c in MODIFIED_COLS if c in self._raw_cols), None)
+        if not col: return None
+        marker = max_marker(self.df[col])
+        if marker is None: return None
+        return f"select * where {col_letter(self._raw_cols.index(col))} > {marker_literal(marker)}"
+
+    def _sync_source(self, source):
+        if source == INVENTORY: return self._sync_inventory()
+        if source == SALES_NOTES: return self._sync_notes()
+        return self._sync_tab(source)
+
+    def _fetch(self, source, query=None):
+        # the source's frame, or None after recording why it couldn't be had
+        src = self.sources[source]
+        with span("load.fetch", source=source, delta=query is not None) as sp:
+            try: new = self.fetch(gviz_url(source, query, self.base_url), timeout=src.timeout, retries=src.retries)
+            except FetchError as e:
+                self.errors[source] = str(e)
+                sp.set(error=str(e))
+                return None
+            sp.set(rows=len(new))
+        return new
+
+    def _sync_inventory(self):
+        query = self._delta_query()
+        self._inv_syncs += 1
+        new = self._fetch(INVENTORY, query)
+        if new is None: return 0
+        if new.empty and query is None:
+            # an empty full pull is a failed fetch; keep serving the snapshot
+            self.errors[INVENTORY] = "inventory fetch returned no rows"
+            return 0
+        self.fetched_at[INVENTORY], self.errors[INVENTORY] = time.time(), None
+        if new.empty: return 0  # empty delta: nothing changed since the marker
+        if query is None: self._raw_cols = list(clean_columns(new).columns)
+        with span("load.normalize", rows=len(new)):
+            new = normalize_inventory(new)
+        with span("load.merge", rows=len(new)) as sp:
+            if self.df.empty or list(new.columns) != list(self.df.columns): n = self._replace_inventory(new)
+            else: n = self._merge_inventory(new, full=query is None)
+            sp.set(changed=n)
+        return n
+
+    def save(self, path):
+        """Write the published snapshot under ``path`` for the next cold start."""
+        df, notes, version, _ = self.snapshot
+        if df.empty: return False
+        os.makedirs(path, exist_ok=True)
+        write_frame(df, os.path.join(path, "inventory"))
+        meta = {'version': version, 'saved_at': time.time(), 'fetched_at': self.fetched_at, 'raw_cols': self._raw_cols, 'sales_notes': notes.to_dict()}
+        tmp = os.path.join(path, "meta.json.tmp")
+        with open(tmp, "w") as f: json.dump(meta, f, default=str)
+        os.replace(tmp, os.path.join(path, "meta.json"))
+        return True
+
+    def load(self, path):
+        """Adopt a snapshot written by ``save``; False if there is none or it can't be read.
+
+        Sources stay stale, so the next sync revalidates against Google and
+        merges whatever changed into the loaded rows.
+        """
+        try:
+            with open(os.path.join(path, "meta.json")) as f: meta = json.load(f)
+            df = read_frame(os.path.join(path, "inventory"))
+        except (OSError, ValueError, ImportError): return False
+        with self._lock:
+            self._replace_inventory(df, keep_index=True)
+            self.sales_notes = NotesIndex.from_dict(meta.get('sales_notes'))
+            self._raw_cols = meta.get('raw_cols') or []
+            self.fetched_at.update({s: float(t) for s, t in (meta.get('fetched_at') or {}).items() if s in self.fetched_at})
+            self.version += 1
+            self.snapshot = (self.df, self.sales_notes, self.version, self.cube)
+        return True
+
+    def _replace_inventory(self, new, keep_index=False):
+        if not keep_index: new = new.reset_index(drop=True)
+        keys, self._dup_keys = row_keys(new)
+        self._labels = pd.Series(new.index, index=keys)
+        self._hashes = row_hashes(new)
+        with span("index.cube", rows=len(new)): cube = AggregateCube(new)
+        with self._patch_lock: self.df, self.cube = new, cube
+        return len(new)
+
+    def _merge_inventory(self, new, full):
+        keys, dups = row_keys(new)
+        if full: self._dup_keys = dups
+        new_h = row_hashes(new).values
+        labels = self._labels.reindex(keys)
+        known = labels.notna().values
+        known_labels = labels[known].astype('int64').values
+        changed = known.copy()
+        changed[known] = self._hashes.loc[known_labels].values != new_h[known]
+        added = ~known
+        removed = self._labels.index.difference(keys) if full else pd.Index([])
+        if not changed.any() and not added.any() and removed.empty: return 0
+
+        with self._patch_lock: df, cube = self.df.copy(), AggregateCube(table=self.cube.table)
+        align_dtypes(df, new)
+        hashes = self._hashes.copy()
+        lbl_map = self._labels
+        upd = labels[changed].astype('int64').values
+        gone = lbl_map.loc[removed].values.astype('int64')
+        add_lbl = pd.RangeIndex(0)
+        before = df.loc[np.concatenate([upd, gone])]
+        if changed.any():
+            rows = new[changed]
+            for c in df.columns: df.loc[upd, c] = rows[c].values
+            hashes.loc[upd] = new_h[changed]
+        if not removed.empty:
+            df = df.drop(index=gone); hashes = hashes.drop(index=gone)
+            lbl_map = lbl_map.drop(index=removed)
+        if added.any():
+            start = int(self.df.index.max()) + 1 if len(self.df) else 0
+            add_lbl = pd.RangeIndex(start, start + int(added.sum()))
+            rows = new[added].set_axis(add_lbl)
+            df = pd.concat([df, rows])
+            hashes = pd.concat([hashes, pd.Series(new_h[added], index=add_lbl)])
+            lbl_map = pd.concat([lbl_map, pd.Series(add_lbl, index=keys[added])])
+
+        with span("index.cube_delta", rows=len(before) + len(add_lbl)): cube.update(before, df.loc[np.concatenate([upd, add_lbl])])
+        with self._patch_lock: self.df, self.cube = df, cube
+        self._hashes, self._labels = hashes, lbl_map
+        return int(changed.sum() + added.sum() + len(removed))
+
+    def _sync_notes(self):
+        notes_df = self._fetch(SALES_NOTES)
+        if notes_df is None: return 0
+        if notes_df.empty:
+            self.errors[SALES_NOTES] = "sales notes fetch returned no rows"
+            return 0
+        self.fetched_at[SALES_NOTES], self.errors[SALES_NOTES] = time.time(), None
+        h = int(pd.util.hash_pandas_object(notes_df, index=False).sum())
+        if h == self._notes_hash: return 0
+        self._notes_hash = h
+        with span("load.notes_index", rows=len(notes_df)):
+            self.sales_notes = NotesIndex.build(notes_df)
+        return len(notes_df)
+
+    def _sync_tab(self, source):
+        new = self._fetch(source)
+        if new is None: return 0
+        if new.empty:
+            self.errors[source] = f"{source} fetch returned no rows"
+            return 0
+        self.fetched_at[source], self.errors[source] = time.time(), None
+        h = int(pd.util.hash_pandas_object(new, index=False).sum())
+        if h == self._tab_hashes.get(source): return 0
+        self._tab_hashes[source] = h
+        self.tabs[source] = clean_columns(new)
+        return len(new)
+
+
+# --- 5. MYTASKS ASSIGNMENT RULES ---
+# A member's tasks are the rows matching ANY of their rules; a rule matches rows meeting ALL of its
+# conditions: "assigned" (SALES_ASSIGNEDTO is the member), "contsize" / "season" / "block" lists,
+# and "min_priority" / "max_priority" (inclusive). Members without rules get {"assigned": true}.
+RULES_PATH = "leaflink_rules.json"
+HEAVY_SIZES = ["#7", "#10", "#15", "#25", "#45", "7DP"]
+DEFAULT_RULES = {'members': [
+    {'name': "Dylan", 'rules': [{'assigned': True}, {'contsize': HEAVY_SIZES}]},
+    {'name': "Zoe"}, {'name': "Morgan"}, {'name': "Kayla"},
+]}
+RULE_COLS = {'contsize': 'CONTSIZE', 'season': 'SEASON', 'block': 'BLOCKALPHA'}
+RULE_KEYS = {'assigned', 'min_priority', 'max_priority', *RULE_COLS}
+
+
+class AssignmentRules:
+    """Per-member assignment rules from ``leaflink_rules.json`` (DEFAULT_RULES when the file is missing).
+
+    ``reload`` re-reads the file when it changes on disk; a file that fails to
+    parse or validate is reported in ``error`` and the previous rules stay live.
+    """
+
+    def __init__(self, config=None, path=None):
+        self.path = path
+        self.error = None
+        self._mtime = None
+        self.members = self.parse(config or DEFAULT_RULES)
+        if path: self.reload()
+
+    @staticmethod
+    def parse(config):
+        members = {}
+        for m in config['members']:
+            name = str(m['name']).strip()
+            rules = m.get('rules') or [{'assigned': True}]
+            if not isinstance(rules, list) or not all(isinstance(r, dict) for r in rules): raise ValueError(f"{name}: rules must be a list of objects")
+            for r in rules:
+                unknown = set(r) - RULE_KEYS
+                if unknown: raise ValueError(f"{name}: unknown rule keys {sorted(unknown)}")
+                for key, value in r.items():
+                    # checked here so a bad value is rejected on reload instead of failing the index build
+                    if key == 'assigned': ok, want = isinstance(value, bool), "true or false"
+                    elif key in RULE_COLS: ok, want = isinstance(value, list) and all(isinstance(v, str) for v in value), "a list of strings"
+                    else: ok, want = isinstance(value, (int, float)) and not isinstance(value, bool), "a number"
+                    if not ok: raise ValueError(f"{name}: {key} must be {want}, got {value!r}")
+            members[name.upper()] = {'name': name, 'rules': rules}
+        return members
+
+    def names(self):
+        return [m['name'] for m in self.members.values()]
+
+    def reload(self):
+        """Re-read the config if it changed; True when the rules were replaced."""
+        if not self.path: return False
+        try: mtime = os.path.getmtime(self.path)
+        except OSError: mtime = None
+        if mtime == self._mtime: return False
+        self._mtime = mtime
+        try:
+            if mtime is None: members = self.parse(DEFAULT_RULES)
+            else:
+                with open(self.path) as f: members = self.parse(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.error = f"{self.path}: {e}"
+            return False
+        changed, self.members, self.error = members != self.members, members, None
+        return changed
+
+    def compile(self, df):
+        """member -> boolean row mask; each distinct condition is evaluated once and shared."""
+        n = len(df)
+        cache = {}
+
+        def cond(key, value):
+            ck = (key, json.dumps(value, sort_keys=True))
+            if ck not in cache:
+                if key in RULE_COLS: m = df[RULE_COLS[key]].isin(value).values
+                else:
+                    if 'PRIORITY' not in cache: cache['PRIORITY'] = to_number(df['PRIORITY']).to_numpy(dtype=float, na_value=np.nan)
+                    prio = cache['PRIORITY']
+                    m = prio >= float(value) if key == 'min_priority' else prio <= float(value)
+                cache[ck] = np.asarray(m, dtype=bool)
+            return cache[ck]
+
+        assigned = pd.Series(key_values(df['SALES_ASSIGNEDTO'])).str.strip().str.upper().values
+        masks = {}
+        for user, m in self.members.items():
+            mask = np.zeros(n, dtype=bool)
+            for rule in m['rules']:
+                hit = np.ones(n, dtype=bool)
+                for key, value in rule.items():
+                    if key == 'assigned': hit &= (assigned == user) if value else (assigned != user)
+                    else: hit &= cond(key, value)
+                mask |= hit
+            masks[user] = mask
+        return masks
+
+
+class TaskIndex:
+    """user -> status -> BLOCKALPHA -> LOCATIONCODE -> row positions, built once per data version.
+
+    Rows are grouped by (status, block, location) once; each member's compiled
+    rule mask is then split along those groups, so more staff or rules only
+    adds a mask, never a per-rerun scan. Every MYTASKS drill-down step is a
+    dict lookup; ``rows`` is the only call that touches the frame, and only for
+    the rows of one location.
+    """
+
+    def __init__(self, df, rules=None):
+        self.df = df
+        self.tree = {}
+        self.totals = {}
+        self.block_counts = self.loc_counts = {}
+        if df.empty: return
+        masks = (rules or AssignmentRules()).compile(df)
+        complete = np.asarray(df['STATUS'] == 'COMPLETE', dtype=bool)
+        status = np.where(complete, 'complete', 'pending')
+        groups = pd.DataFrame({'s': status, 'b': key_values(df['BLOCKALPHA']), 'l': key_values(df['LOCATIONCODE'])}).groupby(['s', 'b', 'l'], sort=True)
+        gid, keys = groups.ngroup().values, groups.size().index
+        for user, mask in masks.items():
+            pos = np.flatnonzero(mask)
+            pos = pos[np.argsort(gid[pos], kind='stable')]
+            ids, starts = np.unique(gid[pos], return_index=True)
+            tree = self.tree[user] = {}
+            for g, part in zip(ids, np.split(pos, starts[1:])):
+                st_, b, l = keys[g]
+                tree.setdefault(st_, {}).setdefault(b, {})[l] = part
+        # pending/complete badges for every member in one matrix pass
+        if masks:
+            users = list(masks)
+            m = np.vstack([masks[u] for u in users])
+            done = m @ complete.astype(np.int64)
+            self.totals = {u: {'pending': int(t - d), 'complete': int(d)} for u, t, d in zip(users, m.sum(axis=1), done)}
+        # counts are read on every rerun, so resolve them once here
+        self.block_counts = {u: {s: {b: sum(len(p) for p in locs.values()) for b, locs in sorted(blocks.items())} for s, blocks in by_s.items()} for u, by_s in self.tree.items()}
+        self.loc_counts = {u: {s: {b: {l: len(p) for l, p in sorted(locs.items())} for b, locs in blocks.items()} for s, blocks in by_s.items()} for u, by_s in self.tree.items()}
+
+    def counts(self, user):
+        return self.totals.get(user, {'pending': 0, 'complete': 0})
+
+    def blocks(self, user, status):
+        return self.block_counts.get(user, {}).get(status, {})
+
+    def locations(self, user, status, block):
+        return self.loc_counts.get(user, {}).get(status, {}).get(block, {})
+
+    def rows(self, user, status, block, loc):
+        pos = self.tree.get(user, {}).get(status, {}).get(block, {}).get(loc)
+        return self.df.iloc[pos] if pos is not None else self.df.iloc[:0]
+
+
+# --- 6. VARIETY SEARCH ---
+def trigrams(s):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def close_ratio(a, b):
+    m = SequenceMatcher(None, a, b)
+    return m.ratio() if m.real_quick_ratio() >= 0.8 and m.quick_ratio() >= 0.8 else 0.0
+
+
+def word_spans(name, k):
+    # runs of k consecutive words, punctuation dropped ("Maple, Red" -> "maple", "red" / "maple red"), plus all of it
+    words = re.findall(r"\w+", name)
+    return [" ".join(words[j:j + k]) for j in range(len(words) - k + 1)] + [" ".join(words)]
+
+
+class NameSearch:
+    """Trigram index over variety names with ranked, paged results.
+
+    Ranking: exact, prefix, word start, anywhere in the name; only when none
+    of those match, close spellings of as many consecutive words as the query
+    has, or of the whole name, so "mapel" still finds "Maple, Red" and "autum
+    blaze" finds "Autumn Blaze". Ties sort alphabetically because ids follow the sorted names.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.lower = [n.lower() for n in self.names]
+        postings = {}
+        for i, n in enumerate(self.lower):
+            for g in trigrams(n): postings.setdefault(g, []).append(i)
+        self.postings = {g: np.array(ids, dtype=np.int32) for g, ids in postings.items()}
+
+    def ids_for(self, names):
+        return np.isin(np.array(self.names, dtype=object), list(names))
+
+    def rank(self, query, allowed=None):
+        q = query.strip().lower()
+        n = len(self.names)
+        ok = allowed if allowed is not None else np.ones(n, dtype=bool)
+        if not q: return np.flatnonzero(ok)
+        grams = trigrams(q)
+        if grams:
+            hits = [self.postings[g] for g in grams if g in self.postings]
+            counts = np.bincount(np.concatenate(hits), minlength=n) if hits else np.zeros(n, dtype=np.int64)
+            candidates = np.flatnonzero(ok & (counts == len(grams)))
+        else:
+            candidates = np.flatnonzero(ok)  # 1-2 letters: the pre-lowered scan is cheap enough
+        tiers = ([], [], [], [])
+        for i in candidates:
+            name = self.lower[i]
+            pos = name.find(q)
+            if pos < 0: continue
+            tiers[0 if name == q else 1 if pos == 0 else 2 if f" {q}" in f" {name}" else 3].append(i)
+        ranked = [i for t in tiers for i in t]
+        if not ranked and grams:
+            # no literal hit: fall back to near spellings among names sharing any trigram
+            words = re.findall(r"\w+", q)
+            q_words, scored = " ".join(words), []
+            for i in np.flatnonzero(ok & (counts > 0)):
+                r = max(close_ratio(q_words, w) for w in word_spans(self.lower[i], max(1, len(words))))
+                if r >= 0.8: scored.append((-r, i))
+            ranked = [i for _, i in sorted(scored)]
+        return np.array(ranked, dtype=np.intp)
+
+
+# --- 7. DRIVEAROUND INDEX ---
+class _SeasonView:
+    __slots__ = ('names', 'sizes', 'leaves', 'allowed', 'searches')
+
+    def __init__(self, names, sizes, leaves, allowed):
+        self.names, self.sizes, self.leaves, self.allowed = names, sizes, leaves, allowed
+        self.searches = {}
+
+
+class DriveIndex:
+    """Season-filtered variety/size lookups for DRIVEAROUND, memoized per season set.
+
+    Nothing here copies the frame: a season set resolves to row positions once,
+    and the variety list, size lists and final rows for it are kept until the
+    data version changes.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.views = {}
+        self.search_index = NameSearch([])
+        self._season_pos = {}
+        self._names = self._sizes = np.array([], dtype=object)
+        if df.empty: return
+        self._names, self._sizes = key_values(df['COMMONNAME']), key_values(df['CONTSIZE'])
+        season = key_values(df['SEASON'])
+        self._season_pos = pd.Series(season).groupby(season).indices
+        self.search_index = NameSearch(self.view(()).names)
+
+    def positions(self, seasons):
+        if not seasons: return np.arange(len(self.df))
+        parts = [self._season_pos[s] for s in seasons if s in self._season_pos]
+        return np.sort(np.concatenate(parts)) if parts else np.array([], dtype=np.intp)
+
+    def view(self, seasons):
+        key = frozenset(seasons)
+        v = self.views.get(key)
+        if v is None:
+            pos = self.positions(key)
+            leaves = {k: pos[p] for k, p in pd.DataFrame({'n': self._names[pos], 's': self._sizes[pos]}).groupby(['n', 's'], sort=True).indices.items()}
+            sizes = {}
+            for n, s in leaves:
+                if str(s).strip(): sizes.setdefault(n, []).append(s)
+            names = [n for n in sorted({n for n, _ in leaves}) if str(n).strip()]
+            allowed = self.search_index.ids_for(names) if key else None
+            v = self.views[key] = _SeasonView(names, sizes, leaves, allowed)
+        return v
+
+    def names(self, seasons):
+        return self.view(seasons).names
+
+    def sizes(self, seasons, name):
+        return self.view(seasons).sizes.get(name, [])
+
+    def search(self, seasons, query, limit=50):
+        """Up to ``limit`` ranked names for the query, plus the total number of matches."""
+        v = self.view(seasons)
+        key = query.strip().lower()
+        ranked = v.searches.get(key)
+        if ranked is None:
+            if len(v.searches) >= 256: v.searches.clear()
+            ranked = v.searches[key] = self.search_index.rank(key, v.allowed)
+        return [self.search_index.names[i] for i in ranked[:limit]], len(ranked)
+
+    def rows(self, seasons, name, size):
+        pos = self.view(seasons).leaves.get((name, size))
+        return self.df.iloc[pos] if pos is not None else self.df.iloc[:0]
+
+
+# --- 8. DASHBOARD CUBE ---
+CUBE_DIMS = ['SEASON', 'BLOCKALPHA', 'CONTSIZE', 'SALES_ASSIGNEDTO']
+CUBE_MEASURES = ['ROWS', 'COMPLETE', 'PRIME_QTY', 'PTRAVAILABLE', 'PRIORITY_SUM', 'PRIORITY_N']
+CUBE_COLS = {*CUBE_DIMS, 'STATUS', 'PRIME_QTY', 'PTRAVAILABLE', 'PRIORITY'}  # edits to these move the cube
+
+
+class AggregateCube:
+    """OVERVIEW / SALESINVTRACKING totals per SEASON x BLOCKALPHA x CONTSIZE x SALES_ASSIGNEDTO cell.
+
+    Each cell holds the row count, completions, PRIME_QTY and PTRAVAILABLE sums
+    and the PRIORITY sum/count, so dashboards only ``rollup`` a few thousand
+    cells and never touch the frame. Merges and edits hand over the affected
+    rows before and after; only their difference is added to the table, so
+    keeping the cube current costs the size of the change.
+    """
+
+    def __init__(self, df=None, table=None):
+        self.table = table if table is not None else self.cells(df)
+        self.views = {}
+
+    @staticmethod
+    def cells(df):
+        if df is None or df.empty:
+            return pd.DataFrame(columns=CUBE_MEASURES, index=pd.MultiIndex.from_arrays([[]] * len(CUBE_DIMS), names=CUBE_DIMS), dtype=float)
+        prio = to_number(df['PRIORITY']).to_numpy(dtype=float, na_value=np.nan)
+        parts = pd.DataFrame({d: key_values(df[d]) for d in CUBE_DIMS})
+        parts['ROWS'] = 1.0
+        parts['COMPLETE'] = np.asarray(df['STATUS'] == 'COMPLETE', dtype=float)
+        for c in ('PRIME_QTY', 'PTRAVAILABLE'): parts[c] = to_number(df[c]).to_numpy(dtype=float, na_value=0.0)
+        parts['PRIORITY_SUM'], parts['PRIORITY_N'] = np.nan_to_num(prio), (~np.isnan(prio)).astype(float)
+        return parts.groupby(CUBE_DIMS, sort=False).sum()
+
+    def update(self, old, new):
+        """Replace the contribution of rows ``old`` with that of ``new`` (either may be empty)."""
+        delta = self.cells(new).sub(self.cells(old), fill_value=0)
+        table = self.table.add(delta, fill_value=0)
+        # one swap, so a concurrent rollup sees the old table or the new one
+        self.table, self.views = table[table['ROWS'] > 0], {}
+
+    def values(self, dim):
+        return sorted(v for v in self.table.index.unique(level=dim) if str(v).strip())
+
+    def rollup(self, by=(), **filters):
+        """Totals grouped by the ``by`` dims over cells matching ``filters`` (dim=value or list of values).
+
+        Adds PCT_COMPLETE and AVG_PRIORITY; memoized until the cube changes.
+        """
+        key = (tuple(by), tuple(sorted((d, v if isinstance(v, str) else tuple(v)) for d, v in filters.items())))
+        views = self.views
+        out = views.get(key)
+        if out is None:
+            t = self.table
+            for d, v in key[1]: t = t[t.index.get_level_values(d).isin([v] if isinstance(v, str) else v)]
+            out = t.groupby(level=list(by), sort=True).sum() if by else t.sum().to_frame().T
+            n = out['ROWS'].where(out['ROWS'] > 0)
+            out['PCT_COMPLETE'] = (100 * out['COMPLETE'] / n).round(1)
+            out['AVG_PRIORITY'] = (out['PRIORITY_SUM'] / out['PRIORITY_N'].where(out['PRIORITY_N'] > 0)).round(2)
+            out = views[key] = out.drop(columns=['PRIORITY_SUM', 'PRIORITY_N'])
+        return out
+
+
+# --- 9. SHARED DATA STORE ---
+class Snapshot:
+    """One published data version: the frame, notes map and the indexes built on them.
+
+    Sessions only ever read these; every session on a version shares the same
+    objects, so a rerun costs no copies and no index builds. The one writer is
+    ``SheetSync.patch``: a saved edit lands in place in ``df`` (and ``cube``) of
+    the current version, so every session sees it without waiting for a new
+    one. Edited cells are never ones the task or drive indexes are keyed on.
+    """
+    __slots__ = ('version', 'df', 'sales_notes', 'cube', 'rules', 'tasks', 'drive', 'published_at')
+
+    def __init__(self, version, df, sales_notes, cube=None, rules=None):
+        self.version, self.df, self.sales_notes = version, df, sales_notes
+        self.cube = cube if cube is not None else AggregateCube(df)
+        self.rules = rules or AssignmentRules()
+        with span("index.tasks", rows=len(df)): self.tasks = TaskIndex(df, self.rules)
+        with span("index.drive", rows=len(df)): self.drive = DriveIndex(df)
+        self.published_at = time.time()
+
+
+class DataStore:
+    """Process-wide owner of the current Snapshot, refreshed by one background thread.
+
+    ``current`` is swapped with a single assignment once the new version and its
+    indexes are fully built, so readers see either the old snapshot or the new
+    one, never a half-built mix. Between versions the current snapshot only
+    changes through in-place edit patches (see ``Snapshot``). ``on_sync`` runs
+    against the SheetSync before each publish (the write queue uses it to
+    re-apply pending edits).
+
+    With ``snapshot_dir`` set, every new version is also written to disk. A cold
+    start serves that copy immediately and revalidates against Google in the
+    background (stale-while-revalidate), so a restart or a bad signal never
+    leaves people staring at "Waiting for data...".
+    """
+
+    def __init__(self, sync=None, on_sync=None, snapshot_dir=None, rules=None):
+        self.sync = sync or SheetSync()
+        self.on_sync = on_sync
+        self.snapshot_dir = snapshot_dir
+        self.rules = rules or AssignmentRules()
+        self.current = Snapshot(0, self.sync.df, self.sync.sales_notes, self.sync.cube, self.rules)
+        self.from_disk = False
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def refresh(self, sources=None, force=False):
+        with self._lock, span("load.refresh", force=force): return self._refresh(sources, force)
+
+    def _refresh(self, sources=None, force=False):
+        fetched = self.sync.fetched_at[INVENTORY]
+        try: self.sync.sync(sources, force=force)
+        except Exception as e: self.last_error = str(e)
+        # the inventory came back from Google, so even with no changes it is no longer the disk copy
+        if self.sync.fetched_at[INVENTORY] > fetched: self.from_disk = False
+        if self.on_sync: self.on_sync(self.sync)
+        df, notes, version, cube = self.sync.snapshot
+        # an edited rules file rebuilds the task index on the next tick, even without new data
+        if not self.rules.reload() and version == self.current.version: return self.current
+        # a failed build keeps the current snapshot live rather than taking the store down
+        try: snapshot = Snapshot(version, df, notes, cube, self.rules)
+        except Exception as e:
+            self.last_error = f"snapshot build failed: {e}"
+            return self.current
+        new_data, self.current = version != self.current.version, snapshot
+        if new_data:
+            self.from_disk = False
+            if self.snapshot_dir:
+                try:
+                    with span("load.save", rows=len(df)): self.sync.save(self.snapshot_dir)
+                except Exception as e: self.last_error = f"snapshot save failed: {e}"
+        return self.current
+
+    def get(self):
+        # only a cold start without a saved snapshot blocks, and concurrent cold callers share that one load
+        if self.current.version == 0:
+            with self._lock:
+                if self.current.version == 0 and self.snapshot_dir and self.sync.load(self.snapshot_dir):
+                    df, notes, version, cube = self.sync.snapshot
+                    self.current, self.from_disk = Snapshot(version, df, notes, cube, self.rules), True
+                    self._wake.set()
+                elif self.current.version == 0 and self.sync.stale(INVENTORY): self._refresh()
+        return self.current
+
+    def age(self):
+        """Seconds since the inventory last came back from Google (None if it never has)."""
+        t = self.sync.fetched_at[INVENTORY]
+        return time.time() - t if t else None
+
+    def offline(self):
+        # other sources' failures are listed per source in the sidebar, not as an offline banner
+        return self.from_disk or self.sync.errors[INVENTORY] is not None
+
+    def start(self, interval=None):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval or self.sync.ttl,), name="leaflink-refresh", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set(); self._wake.set()
+        if self._thread: self._thread.join()
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            self._wake.wait(min(interval, 30))
+            self._wake.clear()
+            if self._stop.is_set(): break
+            # failed fetches retry on the next tick instead of waiting out the TTL
+            try:
+                if self.from_disk or any(self.sync.errors.values()) or any(self.sync.stale(s) for s in self.sync.sources): self.refresh()
+            except Exception as e: self.last_error = f"refresh failed: {e}"  # keep the thread alive for the next tick
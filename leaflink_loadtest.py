@@ -0,0 +1,124 @@
+"""Concurrent-session load test for the MYTASKS data path (no Streamlit needed).
+
+Simulates N sessions, each on its own thread like Streamlit's script runners,
+clicking block -> location -> list_items over and over, and reports p50/p95
+rerun latency and peak RSS for two models:
+
+  shared  - one DataStore snapshot and its prebuilt indexes, read by everyone
+  legacy  - the old path: st.cache_data hands each rerun an unpickled copy of
+            the frame, then the rerun masks and groups it
+
+    python leaflink_loadtest.py --rows 50000 --sessions 10 --reruns 12
+"""
+import argparse
+import json
+import pickle
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from leaflink_bench import synthetic_sheets
+from leaflink_data import HEAVY_SIZES, INVENTORY, DataStore, SheetSync, display_col
+
+USERS = ["DYLAN", "ZOE", "MORGAN", "KAYLA"]
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)) * 1000, 3) if values else 0.0
+
+
+def shared_session(store, user, status, rng, lat):
+    t0 = time.perf_counter()
+    tasks = store.get().tasks
+    blocks = tasks.blocks(user, status)
+    lat.append(time.perf_counter() - t0)
+    if not blocks: return
+    block = rng.choice(list(blocks))
+    t0 = time.perf_counter()
+    locs = store.get().tasks.locations(user, status, block)
+    lat.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    page = store.get().tasks.rows(user, status, block, rng.choice(list(locs))).iloc[:20]
+    for c in ['COMMONNAME', 'CONTSIZE', 'LOTCODE', 'PRIORITY', 'PTRAVAILABLE']: display_col(page[c])
+    lat.append(time.perf_counter() - t0)
+
+
+def legacy_session(blob, user, status, rng, lat):
+    def my_data():
+        df = pickle.loads(blob)  # what st.cache_data returned on every call
+        m = df[(df['CONTSIZE'].isin(HEAVY_SIZES)) | (df['SALES_ASSIGNEDTO'].str.upper() == "DYLAN")] if user == "DYLAN" else df[df['SALES_ASSIGNEDTO'].str.upper() == user]
+        return m[m['STATUS'] == 'COMPLETE'] if status == "complete" else m[m['STATUS'] != 'COMPLETE']
+
+    t0 = time.perf_counter()
+    m = my_data()
+    blocks = m.groupby('BLOCKALPHA').size()
+    lat.append(time.perf_counter() - t0)
+    if blocks.empty: return
+    block = rng.choice(list(blocks.index))
+    t0 = time.perf_counter()
+    m = my_data()
+    locs = m[m['BLOCKALPHA'] == block].groupby('LOCATIONCODE').size()
+    lat.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    m = my_data()
+    final = m[(m['BLOCKALPHA'] == block) & (m['LOCATIONCODE'] == rng.choice(list(locs.index)))]
+    for _ in final.iterrows(): pass
+    lat.append(time.perf_counter() - t0)
+
+
+def run(mode, rows, sessions, reruns, seed=0):
+    raw = synthetic_sheets(rows, seed)[0]
+    if mode == "shared":
+        store = DataStore(SheetSync(fetch=lambda url, **kw: raw.copy() if INVENTORY in url else pd.DataFrame()))
+        store.get()
+        target, arg = shared_session, store
+    else:
+        legacy = raw.copy()
+        legacy.columns = legacy.columns.str.strip().str.upper()
+        target, arg = legacy_session, pickle.dumps(legacy.fillna("").astype(str))
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    lats = [[] for _ in range(sessions)]
+
+    def worker(i):
+        rng = random.Random(seed + i)
+        for _ in range(reruns // 3 or 1):
+            target(arg, rng.choice(USERS), rng.choice(["pending", "complete"]), rng, lats[i])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(sessions)]
+    t0 = time.perf_counter()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    wall = time.perf_counter() - t0
+    flat = [x for l in lats for x in l]
+    return {'mode': mode, 'rows': rows, 'sessions': sessions, 'reruns': len(flat), 'wall_s': round(wall, 3),
+            'p50_ms': percentile(flat, 50), 'p95_ms': percentile(flat, 95),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'rss_growth_mb': round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) / 1024, 1)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, default=50000)
+    ap.add_argument("--sessions", type=int, default=10)
+    ap.add_argument("--reruns", type=int, default=12, help="reruns per session")
+    ap.add_argument("--mode", choices=["shared", "legacy"], help="run one model in this process (default: both, each in a fresh process)")
+    args = ap.parse_args()
+    if args.mode:
+        print(json.dumps(run(args.mode, args.rows, args.sessions, args.reruns)))
+        return
+    results = []
+    for mode in ["shared", "legacy"]:
+        out = subprocess.run([sys.executable, __file__, "--mode", mode, "--rows", str(args.rows), "--sessions", str(args.sessions), "--reruns", str(args.reruns)],
+                             capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
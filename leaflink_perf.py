@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+# --- 1. TIMING SPANS ---
+# Every span is logged as one JSON line on the "leaflink.perf" logger (set LEAFLINK_PERF_LOG=1 to
+# print them) and kept in a rolling window per name for the admin panel's p50/p95.
+log = logging.getLogger("leaflink.perf")
+if os.environ.get("LEAFLINK_PERF_LOG") and not log.handlers:
+    _h = logging.StreamHandler()
+    _h.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_h)
+    log.setLevel(logging.INFO)
+
+WINDOW = 200  # samples kept per span name
+_samples = {}
+_lock = threading.Lock()
+
+
+class span:
+    """``with span("page.MYTASKS.block") as sp: ...; sp.set(rows=n, widgets=k)``"""
+
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+
+    def set(self, **fields):
+        self.fields.update(fields)
+        return self
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (time.perf_counter() - self.t0) * 1000
+        record(self.name, ms, **self.fields)
+        return False
+
+
+def record(name, ms, **fields):
+    with _lock:
+        q = _samples.get(name)
+        if q is None: q = _samples[name] = deque(maxlen=WINDOW)
+        q.append((ms, fields))
+    if log.isEnabledFor(logging.INFO):
+        log.info(json.dumps({'span': name, 'ms': round(ms, 3), 'ts': time.time(), **fields}, default=str))
+
+
+# --- 2. ROLLING STATS ---
+def pct(sorted_ms, q):
+    return sorted_ms[min(len(sorted_ms) - 1, int(round(q / 100 * (len(sorted_ms) - 1))))]
+
+
+def stats():
+    """One row per span name: sample count, p50/p95/last in ms, and the last rows/widgets seen."""
+    with _lock: snap = {k: list(v) for k, v in _samples.items()}
+    out = []
+    for name, samples in sorted(snap.items()):
+        ms = sorted(s[0] for s in samples)
+        last_ms, last_fields = samples[-1]
+        out.append({'span': name, 'n': len(samples), 'p50_ms': round(pct(ms, 50), 2), 'p95_ms': round(pct(ms, 95), 2),
+                    'last_ms': round(last_ms, 2), 'rows': last_fields.get('rows'), 'widgets': last_fields.get('widgets')})
+    return out
+
+
+def reset():
+    with _lock: _samples.clear()
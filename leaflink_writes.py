@@ -0,0 +1,252 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from leaflink_data import INVENTORY, ROW_KEY, code_text, col_letter
+
+# --- 1. EDIT JOURNAL ---
+EDITABLE_COLS = ['CALIPER', 'MATCH_PCT', 'LOC_SALESNOTE', 'SPEC', 'PRIME_QTY', 'LOC_COMMENTS', 'PIC_NOTE']
+
+
+def norm_key(v):
+    # sheet cells and the typed frame disagree on "123" vs "123.0"; compare on the bare text
+    s = "" if v is None or (isinstance(v, float) and v != v) or v is pd.NA else str(v).strip()
+    return s[:-2] if s.endswith(".0") and s[:-2].lstrip("-").isdigit() else s
+
+
+MATCH_STEPS = [str(i) for i in range(0, 105, 5)]
+
+
+def match_choices(current):
+    """MATCH % options and the index of the row's value; a blank cell stays blank unless one is picked."""
+    current = str(current).strip()
+    options = MATCH_STEPS if current in MATCH_STEPS else [current] + MATCH_STEPS
+    return options, options.index(current)
+
+
+def changed_cells(row, edits):
+    # fields whose saved value differs from what the row showed (``display_row`` text)
+    return {k: v for k, v in edits.items() if str(v).strip() != row.get(k, '')}
+
+
+def key_mask(df, key):
+    same = pd.Series(True, index=df.index)
+    for c, v in zip(ROW_KEY, key): same &= code_text(df[c]) == v
+    return same
+
+
+def row_identity(df, label):
+    """(ITEMCODE, LOTCODE, LOCATIONCODE) of a row plus how many earlier rows share that key."""
+    key = tuple(norm_key(df.at[label, c]) for c in ROW_KEY)
+    return key, int(key_mask(df.iloc[:df.index.get_loc(label)], key).sum())
+
+
+def locate(df, key, dup=0):
+    hits = df.index[key_mask(df, key)]
+    return hits[dup] if dup < len(hits) else None
+
+
+# --- 2. SHEET SERVICES ---
+class GSpreadService:
+    """Thin adapter over a gspread Spreadsheet: one API request per call."""
+
+    def __init__(self, spreadsheet):
+        self.ss = spreadsheet
+
+    def get_values(self, sheet, ranges):
+        return [list(r) for r in self.ss.worksheet(sheet).batch_get(ranges)]
+
+    def batch_update(self, sheet, updates):
+        self.ss.worksheet(sheet).batch_update([{'range': r, 'values': v} for r, v in updates], value_input_option='USER_ENTERED')
+
+
+class FakeSheetService:
+    """In-memory stand-in for GSpreadService. ``fail_next`` makes the next calls raise, like a quota error."""
+
+    def __init__(self, sheets):
+        self.sheets = {name: [list(r) for r in rows] for name, rows in sheets.items()}
+        self.calls = []
+        self.failures = 0
+
+    def fail_next(self, n=1):
+        self.failures = n
+
+    def _call(self, kind, payload):
+        self.calls.append((kind, payload))
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("429: Quota exceeded (fake)")
+
+    def _cell_ref(self, ref):
+        letters = ref.rstrip("0123456789")
+        col = 0
+        for ch in letters: col = col * 26 + ord(ch) - 64
+        return (int(ref[len(letters):]) if ref[len(letters):] else None), col - 1
+
+    def get_values(self, sheet, ranges):
+        self._call('get', ranges)
+        rows = self.sheets[sheet]
+        out = []
+        for r in ranges:
+            if r == "1:1": out.append([list(rows[0])] if rows else []); continue
+            start, end = r.split(":")
+            r0, c = self._cell_ref(start)
+            out.append([[row[c] if c < len(row) else ""] for row in rows[r0 - 1:]])
+        return out
+
+    def batch_update(self, sheet, updates):
+        self._call('update', updates)
+        rows = self.sheets[sheet]
+        for ref, values in updates:
+            r, c = self._cell_ref(ref)
+            while len(rows) < r: rows.append([])
+            row = rows[r - 1]
+            while len(row) <= c: row.append("")
+            row[c] = values[0][0]
+
+
+# --- 3. WRITE QUEUE ---
+class WriteQueue:
+    """Durable, coalescing write-back of cell edits to the inventory sheet.
+
+    ``record`` appends edits to a SQLite journal and returns immediately. A
+    background flusher takes the latest value per (row, column), resolves rows
+    by ITEMCODE/LOTCODE/LOCATIONCODE against the live sheet (so reordered or
+    inserted sheet rows can't misdirect a write) and pushes everything as one
+    batched range update every ``interval`` seconds, so a burst of saves
+    costs two API requests (key lookup + write). Calls are spaced
+    ``min_interval`` seconds apart, failures back off exponentially, and
+    unflushed edits survive restarts.
+    """
+
+    def __init__(self, path="leaflink_writes.db", service=None, sheet=INVENTORY, interval=5.0, min_interval=1.0, batch_size=200, max_backoff=300.0):
+        self.service = service
+        self.sheet = sheet
+        self.interval = interval
+        self.min_interval = min_interval
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.last_error = None
+        self.next_try = 0.0
+        self.overlaid_version = None
+        self._last_call = 0.0
+        self._header = None
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS edits (id INTEGER PRIMARY KEY, row_key TEXT, dup INTEGER, field TEXT, value TEXT, ts REAL, state INTEGER DEFAULT 0)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS edits_pending ON edits (state, row_key, dup, field)")
+
+    # journal
+    def record(self, key, dup, values):
+        rows = [(json.dumps(list(key)), dup, f, str(v), time.time()) for f, v in values.items() if f in EDITABLE_COLS]
+        with self._lock, self.db:
+            self.db.executemany("INSERT INTO edits (row_key, dup, field, value, ts) VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def pending(self):
+        """Latest unflushed value per (row, field) as dicts; older edits to the same cell are superseded."""
+        with self._lock:
+            cur = self.db.execute("SELECT row_key, dup, field, value, MAX(id) FROM edits WHERE state = 0 GROUP BY row_key, dup, field ORDER BY MAX(id)")
+            return [{'key': tuple(json.loads(k)), 'dup': d, 'field': f, 'value': v, 'id': i} for k, d, f, v, i in cur.fetchall()]
+
+    def pending_count(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(DISTINCT row_key || '|' || dup || '|' || field) FROM edits WHERE state = 0").fetchone()[0]
+
+    def _mark(self, edits, state):
+        with self._lock, self.db:
+            self.db.executemany("UPDATE edits SET state = ? WHERE state = 0 AND row_key = ? AND dup = ? AND field = ? AND id <= ?",
+                                [(state, json.dumps(list(e['key'])), e['dup'], e['field'], e['id']) for e in edits])
+
+    def overlay(self, sync):
+        """Re-apply unflushed edits onto a freshly synced frame so nobody sees the old values."""
+        if self.overlaid_version == sync.version: return
+        self.overlaid_version = sync.version
+        by_row = {}
+        for e in self.pending(): by_row.setdefault((e['key'], e['dup']), {})[e['field']] = e['value']
+        for (key, dup), values in by_row.items():
+            label = locate(sync.df, key, dup)
+            if label is not None: sync.patch(label, values)
+
+    # flushing
+    def _throttle(self):
+        wait = self._last_call + self.min_interval - time.monotonic()
+        if wait > 0: time.sleep(wait)
+        self._last_call = time.monotonic()
+
+    def _sheet_rows(self):
+        self._throttle()
+        if self._header is None:
+            self._header = [str(h).strip().upper() for h in (self.service.get_values(self.sheet, ["1:1"])[0] or [[]])[0]]
+            self._throttle()
+        letters = [col_letter(self._header.index(c)) for c in ROW_KEY]
+        cols = self.service.get_values(self.sheet, [f"{L}2:{L}" for L in letters])
+        n = max(len(c) for c in cols)
+        cells = [[norm_key(c[i][0] if i < len(c) and c[i] else "") for c in cols] for i in range(n)]
+        rows, seen = {}, {}
+        for i, key in enumerate(cells):
+            key = tuple(key)
+            d = seen[key] = seen.get(key, -1) + 1
+            rows[(key, d)] = i + 2
+        return rows
+
+    def flush(self):
+        """Push pending edits now; returns the number of cells written (0 while backing off)."""
+        if self.service is None or time.monotonic() < self.next_try: return 0
+        if not self._flushing.acquire(blocking=False): return 0
+        try: return self._flush()
+        finally: self._flushing.release()
+
+    def _flush(self):
+        edits = self.pending()
+        if not edits: return 0
+        try:
+            rows = self._sheet_rows()
+            ready, orphans = [], []
+            for e in edits:
+                r = rows.get((e['key'], e['dup']))
+                if r is None or e['field'] not in self._header: orphans.append(e); continue
+                ready.append((f"{col_letter(self._header.index(e['field']))}{r}", e))
+            for i in range(0, len(ready), self.batch_size):
+                chunk = ready[i:i + self.batch_size]
+                self._throttle()
+                self.service.batch_update(self.sheet, [(ref, [[e['value']]]) for ref, e in chunk])
+                self._mark([e for _, e in chunk], 1)
+            # the row is gone from the sheet; keep the edit in the journal for reference but stop retrying
+            if orphans: self._mark(orphans, 2)
+            self.failures, self.last_error = 0, None
+            return len(ready)
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            self._header = None
+            delay = min(self.max_backoff, self.interval * 2 ** (self.failures - 1))
+            self.next_try = time.monotonic() + delay * (0.5 + random.random() / 2)
+            return 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="leaflink-writes", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        t, self._thread = self._thread, None
+        self._wake.set()
+        if t: t.join()
+
+    def _run(self):
+        while self._thread is not None:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
@@ -0,0 +1,348 @@
+import gzip
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+import leaflink_data
+from leaflink_data import INVENTORY, SALES_NOTES, AggregateCube, AssignmentRules, DataStore, DriveIndex, FetchError, HttpFetcher, NameSearch, NotesIndex, SheetSync, gviz_url, register_source
+from leaflink_writes import FakeSheetService, WriteQueue, changed_cells, match_choices
+
+
+def sheet(rows):
+    return pd.DataFrame(rows, columns=['ITEMCODE', 'LOTCODE', 'LOCATIONCODE', 'PRIME_QTY', 'LAST_MODIFIED'])
+
+
+class FakeSheets:
+    """fetch() stand-in: serves ``full`` for plain pulls and ``delta`` for ``tq=`` pulls, logging each URL."""
+
+    def __init__(self, full, delta=None):
+        self.full, self.delta, self.urls = full, delta, []
+
+    def __call__(self, url, **kw):
+        self.urls.append(url)
+        if INVENTORY not in url: return pd.DataFrame({'ITEMCODE': ["I1"], 'SALESNOTE': ["n"]})
+        return (self.delta if "&tq=" in url else self.full).copy()
+
+
+# --- delta / full merges ---
+def test_delta_merge_updates_rows_in_place():
+    fake = FakeSheets(sheet([["I1", "L1", "A", 1, 1], ["I2", "L2", "B", 2, 1], ["I3", "L3", "C", 3, 1]]))
+    sync = SheetSync(fetch=fake)
+    sync.sync(force=True)
+    labels = list(sync.df.index)
+    fake.delta = sheet([["I3", "L3", "C", 30, 2]])
+    assert sync.sync([INVENTORY]) == {INVENTORY: 1}
+    assert "&tq=" in fake.urls[-1]
+    assert list(sync.df.index) == labels
+    assert sync.df['PRIME_QTY'].tolist() == [1, 2, 30]
+
+
+def test_full_merge_drops_rows_gone_from_sheet():
+    fake = FakeSheets(sheet([["I1", "L1", "A", 1, 1], ["I2", "L2", "B", 2, 1]]))
+    sync = SheetSync(fetch=fake, full_every=1)
+    sync.sync(force=True)
+    fake.full = sheet([["I2", "L2", "B", 2, 1], ["I4", "L4", "D", 4, 2]])
+    assert sync.sync([INVENTORY]) == {INVENTORY: 2}
+    assert sync.df['ITEMCODE'].astype(str).tolist() == ["I2", "I4"]
+
+
+def test_repeated_keys_force_full_pulls():
+    # two rows share a key; a delta for the third must not append it a second time
+    rows = [["I1", "L1", "A", 1, 1], ["I1", "L1", "A", 5, 1], ["I2", "L2", "B", 2, 1]]
+    fake = FakeSheets(sheet(rows), delta=sheet([["I2", "L2", "B", 20, 2]]))
+    sync = SheetSync(fetch=fake)
+    sync.sync(force=True)
+    fake.full = sheet(rows[:2] + [["I2", "L2", "B", 20, 2]])
+    assert sync.sync([INVENTORY]) == {INVENTORY: 1}
+    assert "&tq=" not in fake.urls[-1]
+    assert len(sync.df) == 3
+    assert sync.df['PRIME_QTY'].tolist() == [1, 5, 20]
+
+
+def test_numeric_codes_match_across_pulls_with_and_without_blanks():
+    # the blank LOTCODE makes the full pull read that column as floats; the delta reads ints
+    full = sheet([[101, 1, "A", 1, 1], [102, None, "B", 2, 1], [103, 3, "C", 3, 1]])
+    fake = FakeSheets(full, delta=sheet([[103, 3, "C", 30, 2]]))
+    sync = SheetSync(fetch=fake)
+    sync.sync(force=True)
+    assert sync.sync([INVENTORY]) == {INVENTORY: 1}
+    assert "&tq=" in fake.urls[-1]
+    assert len(sync.df) == 3
+    assert sync.df['LOTCODE'].astype(object).tolist() == ["1", pd.NA, "3"]
+    assert sync.df['PRIME_QTY'].tolist() == [1, 2, 30]
+
+
+def test_failed_fetch_stays_stale_until_it_succeeds():
+    fake = FakeSheets(pd.DataFrame())
+    sync = SheetSync(fetch=fake)
+    assert sync.sync() == {INVENTORY: 0, SALES_NOTES: 1}
+    assert sync.errors[INVENTORY] and sync.stale(INVENTORY) and not sync.stale(SALES_NOTES)
+    fake.full = sheet([["I1", "L1", "A", 1, 1]])
+    assert sync.sync() == {INVENTORY: 1}
+    assert sync.errors[INVENTORY] is None and not sync.stale(INVENTORY)
+
+
+# --- on-disk snapshot ---
+def test_save_and_load_round_trip(tmp_path):
+    sync = SheetSync(fetch=FakeSheets(sheet([["I1", "L1", "A", 1, 1], ["I2", "L2", "B", None, 1]])))
+    sync.sync(force=True)
+    assert sync.save(str(tmp_path))
+    cold = SheetSync(fetch=FakeSheets(pd.DataFrame()))
+    assert cold.load(str(tmp_path))
+    pd.testing.assert_frame_equal(cold.df, sync.df)
+    assert cold.sales_notes.options("I1") == sync.sales_notes.options("I1") == ["", "n"]
+    assert cold.fetched_at[INVENTORY] == sync.fetched_at[INVENTORY] and cold.version == 1
+    assert cold.stale(INVENTORY)  # loaded data is revalidated on the next sync
+    assert not SheetSync(fetch=FakeSheets(pd.DataFrame())).load(str(tmp_path / "missing"))
+
+
+def test_cold_start_serves_disk_copy_until_inventory_revalidates(tmp_path):
+    rows = sheet([["I1", "L1", "A", 1, 1]])
+    DataStore(SheetSync(fetch=FakeSheets(rows)), snapshot_dir=str(tmp_path)).refresh(force=True)
+
+    up = {INVENTORY: False}
+
+    def fetch(url, **kw):
+        # sales notes stay down throughout; the inventory comes back later with nothing changed
+        if INVENTORY in url and up[INVENTORY]: return rows.copy()
+        raise FetchError("HTTP 503")
+    store = DataStore(SheetSync(fetch=fetch), snapshot_dir=str(tmp_path))
+    snap = store.get()
+    assert len(snap.df) == 1 and store.from_disk and store.offline()
+    store.refresh()
+    assert store.offline() and store.current is snap
+    up[INVENTORY] = True
+    store.refresh()
+    assert store.sync.errors[INVENTORY] is None and store.sync.errors[SALES_NOTES]
+    assert not store.offline() and store.current is snap
+
+
+# --- sales notes ---
+def test_notes_index_options_and_slots():
+    # ITEMCODE read as floats (a blank elsewhere in the column) still matches the frame's "123"
+    notes = NotesIndex.build(pd.DataFrame({' itemcode ': [123.0, 123.0, 123.0, 77.0, None], 'Sales Note': ["Hold", "Tag", "Hold", "Ship", "lost"]}))
+    assert notes.options("123") == ["", "Hold", "Tag"]  # the repeated "Hold" is listed once
+    assert notes.options("77") == ["", "Ship"] and notes.options("999") == [""]
+    assert notes.slot("123", "Tag") == 2 and notes.slot("123", "") == 0
+    assert notes.slot("123", "Ship") is None and notes.slot("999", "Hold") is None
+    assert notes.options("123") is notes.options("123")
+    again = NotesIndex.from_dict(json.loads(json.dumps(notes.to_dict())))
+    assert again.options("123") == ["", "Hold", "Tag"] and again.slot("77", "Ship") == 1 and len(again) == 3
+    assert NotesIndex.build(pd.DataFrame({'ITEMCODE': ["1"]})).options("1") == [""]
+
+
+# --- variety search ---
+NAMES = ["Elm, Lacebark", "Maple", "Maple, Red", "Oak, Red Maple", "Redbud, Forest Pansy", "Snowmaple"]
+
+
+def test_search_ranks_exact_prefix_word_then_substring():
+    search = NameSearch(NAMES)
+    assert [NAMES[i] for i in search.rank("maple")] == ["Maple", "Maple, Red", "Oak, Red Maple", "Snowmaple"]
+    assert [NAMES[i] for i in search.rank("RED")] == ["Redbud, Forest Pansy", "Maple, Red", "Oak, Red Maple"]
+    assert list(search.rank("")) == list(range(len(NAMES)))
+
+
+@pytest.mark.parametrize("query, expected", [("mapel", ["Maple", "Maple, Red", "Oak, Red Maple"]), ("forrest pansy", ["Redbud, Forest Pansy"]), ("lacebrak", ["Elm, Lacebark"])])
+def test_search_falls_back_to_close_spellings(query, expected):
+    search = NameSearch(NAMES)
+    assert sorted(NAMES[i] for i in search.rank(query)) == expected
+    assert len(search.rank("xyzzy")) == 0
+
+
+def test_drive_search_masks_seasons_and_pages():
+    df = leaflink_data.normalize_inventory(pd.DataFrame({
+        'COMMONNAME': ["Maple, Red", "Maple, Sugar", "Oak, Red", "Maple, Japanese", "Maple, Red"],
+        'CONTSIZE': ["#7", "#15", "#7", "#7", "#15"], 'SEASON': ["F1", "S1", "F1", "S1", "F1"]}))
+    drive = DriveIndex(df)
+    assert drive.search((), "maple") == (["Maple, Japanese", "Maple, Red", "Maple, Sugar"], 3)
+    assert drive.search(("F1",), "maple") == (["Maple, Red"], 1)
+    assert drive.search(("F1",), "mapel") == (["Maple, Red"], 1)
+    assert drive.search((), "a", limit=2) == (["Maple, Japanese", "Maple, Red"], 4)
+    assert drive.sizes(("F1",), "Maple, Red") == ["#15", "#7"]
+    assert len(drive.rows(("F1",), "Maple, Red", "#7")) == 1
+
+
+# --- dashboard cube ---
+def inventory(rows):
+    return pd.DataFrame(rows, columns=['ITEMCODE', 'LOTCODE', 'LOCATIONCODE', 'SEASON', 'BLOCKALPHA', 'CONTSIZE', 'SALES_ASSIGNEDTO', 'STATUS', 'PRIME_QTY', 'PTRAVAILABLE', 'PRIORITY'])
+
+
+def assert_cube_matches_rebuild(sync):
+    fresh = AggregateCube(sync.df).table.sort_index()
+    pd.testing.assert_frame_equal(sync.cube.table.sort_index()[fresh.columns], fresh, check_dtype=False)
+
+
+def test_cube_update_drops_cells_whose_rows_are_gone():
+    df = leaflink_data.normalize_inventory(inventory([["I1", "L1", "A", "F1", "A", "#7", "ZOE", "", 5, 1, 2], ["I2", "L2", "B", "S1", "B", "#7", "ZOE", "COMPLETE", 3, 0, None]]))
+    cube = AggregateCube(df)
+    cube.update(df.iloc[:1], df.iloc[:0])
+    assert len(cube.table) == 1 and cube.rollup().iloc[0][['ROWS', 'COMPLETE', 'PRIME_QTY', 'PCT_COMPLETE']].tolist() == [1, 1, 3, 100]
+    assert cube.rollup(['SEASON'])['ROWS'].to_dict() == {"S1": 1}
+
+
+def test_cube_follows_merges_and_patches():
+    base = [["I1", "L1", "A", "F1", "A", "#7", "ZOE", "", 5, 1, 2], ["I2", "L2", "A", "F1", "A", "#7", "ZOE", "", 1, 1, 4],
+            ["I3", "L3", "B", "S1", "B", "#15", "DYLAN", "COMPLETE", 2, 0, 1], ["I4", "L4", "C", "S1", "C", "#1", "", "", None, 7, None]]
+    fake = FakeSheets(inventory(base))
+    sync = SheetSync(fetch=fake, full_every=1)
+    sync.sync(force=True)
+    assert_cube_matches_rebuild(sync)
+    # I2 changes cell, I4 and its only cell go away, I5 arrives
+    fake.full = inventory([base[0], ["I2", "L2", "A", "S1", "B", "#7", "ZOE", "COMPLETE", 1, 1, 4], base[2],
+                           ["I5", "L5", "D", "U1", "D", "#45", "KAYLA", "", 9, 2, 3]])
+    assert sync.sync([INVENTORY]) == {INVENTORY: 3}
+    assert_cube_matches_rebuild(sync)
+    assert "C" not in sync.cube.values('BLOCKALPHA')
+    published = sync.snapshot[3]
+    label = sync.df.index[sync.df['ITEMCODE'] == "I1"][0]
+    assert sync.patch(label, {'PRIME_QTY': "50", 'CALIPER': "2"})
+    assert_cube_matches_rebuild(sync)
+    assert sync.cube is published and published.rollup(SALES_ASSIGNEDTO="ZOE").iloc[0]['PRIME_QTY'] == 51
+
+
+# --- assignment rules ---
+@pytest.mark.parametrize("rule", [{'contsize': "#7"}, {'min_priority': "high"}, {'assigned': "yes"}, {'season': [1]}, {'blocks': ["A"]}])
+def test_bad_rule_keeps_last_good_rules(tmp_path, rule):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({'members': [{'name': "Zoe", 'rules': [{'season': ["F1"], 'min_priority': 2}]}]}))
+    rules = AssignmentRules(path=str(path))
+    assert rules.names() == ["Zoe"] and rules.error is None
+    path.write_text(json.dumps({'members': [{'name': "Kayla", 'rules': [rule]}]}))
+    os.utime(path, (1, 1))
+    assert not rules.reload()
+    assert rules.error and rules.names() == ["Zoe"]
+
+
+def test_failed_snapshot_build_keeps_store_serving(monkeypatch):
+    store = DataStore(SheetSync(fetch=FakeSheets(sheet([["I1", "L1", "A", 1, 1]]))))
+    first = store.refresh(force=True)
+    assert first.version == 1
+
+    def broken(*a, **kw): raise ValueError("boom")
+    monkeypatch.setattr(leaflink_data, "TaskIndex", broken)
+    store.sync.fetch.full = store.sync.fetch.delta = sheet([["I1", "L1", "A", 2, 2]])
+    assert store.refresh(force=True) is first
+    assert "boom" in store.last_error
+
+
+# --- HTTP loader against a local fixture server ---
+INV_CSV = b"ITEMCODE,LOTCODE,LOCATIONCODE,PRIME_QTY\n" + b"".join(b"I%d,L%d,A,%d\n" % (i, i, i) for i in range(500))
+
+
+class FixtureSheets(BaseHTTPRequestHandler):
+    # sheet=<name> picks the behaviour: CSV (gzipped), FLAKY (503 once), GONE (404), STALL (body stops mid-way)
+    hits = {}
+
+    def log_message(self, *a): pass
+
+    def do_GET(self):
+        sheet = parse_qs(urlparse(self.path).query)['sheet'][0]
+        n = self.hits[sheet] = self.hits.get(sheet, 0) + 1
+        if sheet == "GONE" or (sheet == "FLAKY" and n == 1):
+            self.send_response(404 if sheet == "GONE" else 503); self.send_header("Content-Length", "0"); self.end_headers(); return
+        body = gzip.compress(INV_CSV)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if sheet == "STALL":
+            self.wfile.write(body[:len(body) // 2]); self.wfile.flush(); time.sleep(1.5); return
+        self.wfile.write(body)
+
+
+@pytest.fixture(scope="module")
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), FixtureSheets)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_port}/tq"
+    srv.shutdown()
+
+
+def test_fetch_gzip_csv(server):
+    df = HttpFetcher()(gviz_url("CSV", base=server))
+    assert len(df) == 500 and df['PRIME_QTY'].sum() == sum(range(500))
+
+
+def test_fetch_retries_5xx(server):
+    df = HttpFetcher(backoff=0.01)(gviz_url("FLAKY", base=server), retries=1)
+    assert len(df) == 500 and FixtureSheets.hits["FLAKY"] == 2
+
+
+def test_fetch_404_fails_without_retry(server):
+    with pytest.raises(FetchError, match="404"): HttpFetcher(backoff=0.01)(gviz_url("GONE", base=server), retries=2)
+    assert FixtureSheets.hits["GONE"] == 1
+
+
+def test_fetch_stalled_body_is_retried_then_fetch_error(server):
+    with pytest.raises(FetchError, match="after 2 tries"): HttpFetcher(backoff=0.01)(gviz_url("STALL", base=server), timeout=0.3, retries=1)
+    assert FixtureSheets.hits["STALL"] == 2
+
+
+def test_sync_reports_failures_per_source(server, monkeypatch):
+    monkeypatch.setattr(leaflink_data, "SOURCES", dict(leaflink_data.SOURCES))
+    register_source("CSV"); register_source("GONE", retries=0)
+    sync = SheetSync(base_url=server, sources=["CSV", "GONE"])
+    assert sync.sync(force=True) == {"CSV": 500, "GONE": 0}
+    assert sync.errors == {"CSV": None, "GONE": "HTTP 404"}
+    assert sync.tabs["CSV"].shape == (500, 4) and sync.version == 1
+
+
+# --- write-back against the fake sheet service ---
+@pytest.fixture
+def queue(tmp_path):
+    service = FakeSheetService({INVENTORY: [["ITEMCODE", "LOTCODE", "LOCATIONCODE", "CALIPER", "SPEC"],
+                                            ["I1", "L1", "A", "", ""], ["I2", "L2", "B", "", ""]]})
+    return WriteQueue(path=str(tmp_path / "writes.db"), service=service, min_interval=0)
+
+
+def test_flush_coalesces_edits_into_one_update(queue):
+    queue.record(("I1", "L1", "A"), 0, {'CALIPER': "2", 'SPEC': "x"})
+    queue.record(("I1", "L1", "A"), 0, {'CALIPER': "3"})
+    queue.record(("I2", "L2", "B"), 0, {'SPEC': "y", 'STATUS': "ignored"})
+    assert queue.pending_count() == 3
+    assert queue.flush() == 3
+    assert [k for k, _ in queue.service.calls] == ['get', 'get', 'update']
+    assert queue.service.sheets[INVENTORY][1][3:] == ["3", "x"] and queue.service.sheets[INVENTORY][2][4] == "y"
+    assert queue.pending_count() == 0
+
+
+def test_flush_backs_off_after_failure(queue):
+    queue.record(("I2", "L2", "B"), 0, {'CALIPER': "5"})
+    queue.service.fail_next()
+    assert queue.flush() == 0
+    assert queue.failures == 1 and "429" in queue.last_error and queue.next_try > time.monotonic()
+    calls = len(queue.service.calls)
+    assert queue.flush() == 0 and len(queue.service.calls) == calls  # still backing off: no API call
+    queue.next_try = 0.0
+    assert queue.flush() == 1 and queue.failures == 0
+    assert queue.service.sheets[INVENTORY][2][3] == "5"
+
+
+def test_flush_retires_edits_for_rows_gone_from_sheet(queue):
+    queue.record(("I9", "L9", "Z"), 0, {'CALIPER': "1"})
+    queue.record(("I1", "L1", "A"), 1, {'CALIPER': "1"})  # second copy of a key the sheet has once
+    assert queue.flush() == 0
+    assert queue.pending_count() == 0
+    assert [k for k, _ in queue.service.calls] == ['get', 'get']
+    assert queue.flush() == 0 and len(queue.service.calls) == 2
+
+
+def test_save_on_blank_match_pct_leaves_it_alone(queue):
+    typed = leaflink_data.normalize_inventory(pd.DataFrame({'ITEMCODE': ["I1"], 'LOTCODE': ["L1"], 'LOCATIONCODE': ["A"], 'MATCH_PCT': [None], 'CALIPER': ["2"]}))
+    row = leaflink_data.display_row(typed.iloc[0])
+    options, index = match_choices(row['MATCH_PCT'])
+    assert options[index] == ""
+    # the form is saved with every widget left at its starting value, CALIPER aside
+    edits = {'CALIPER': "3", 'MATCH_PCT': options[index], 'SPEC': row['SPEC']}
+    assert changed_cells(row, edits) == {'CALIPER': "3"}
+    queue.record(("I1", "L1", "A"), 0, changed_cells(row, edits))
+    assert [e['field'] for e in queue.pending()] == ['CALIPER']
+    assert match_choices("80") == (options[1:], 16)